@@ -0,0 +1,64 @@
+from aggregation import JitterEstimator
+
+# In adaptive mode each host is probed at BASE_RATE while its link looks healthy. A lost probe, or jitter
+# above JITTER_RATIO of the usual round-trip time (and at least JITTER_MIN seconds), sends it straight to
+# the burst rate for a closer look. Once nothing has looked wrong for HOLD_SECONDS the rate halves every
+# BACKOFF_SECONDS, back down to the base rate.
+BASE_RATE = 1.0
+BURST_RATE = 50.0
+HOLD_SECONDS = 30
+BACKOFF_SECONDS = 10
+JITTER_RATIO = 0.5
+JITTER_MIN = 0.005
+
+
+class RateController:
+    # Picks each host's probe rate from its results. Lives on the scheduler thread, which asks it after every
+    # result whether the host's rate should change. An optional budget caps the probes per second across all
+    # hosts; a host that wants to burst gets what is left of it, and never less than the base rate.
+    def __init__(self, targets, base_rate=BASE_RATE, burst_rate=BURST_RATE, budget=None,
+                 hold_seconds=HOLD_SECONDS, backoff_seconds=BACKOFF_SECONDS):
+        self.base_rate = base_rate
+        self.burst_rate = max(base_rate, burst_rate)
+        self.budget = budget
+        self.hold_seconds = hold_seconds
+        self.backoff_seconds = backoff_seconds
+
+        self.rates = {target: base_rate for target in targets}  # Read by other threads for display
+        self.trouble_at = dict.fromkeys(targets)
+        self.changed_at = dict.fromkeys(targets, 0.0)
+        self.jitter = {target: JitterEstimator() for target in targets}
+        self.rtt_baseline = dict.fromkeys(targets)
+
+    def observe(self, target, now, lost, rtt):
+        # Fold in one result; returns the host's new rate if it should change, otherwise None
+        trouble = lost
+        if rtt is not None:
+            jitter = self.jitter[target].add(rtt)
+            baseline = self.rtt_baseline[target]
+            if baseline is None:
+                self.rtt_baseline[target] = rtt
+            elif jitter > max(JITTER_MIN, JITTER_RATIO * baseline):
+                trouble = True
+            elif not trouble:
+                self.rtt_baseline[target] = baseline + (rtt - baseline) / 64  # Only learns from calm samples
+
+        rate = self.rates[target]
+        if trouble:
+            self.trouble_at[target] = now
+            if rate < self.burst_rate:
+                return self._set_rate(target, now, self.burst_rate)
+        elif (rate > self.base_rate and now - self.trouble_at[target] >= self.hold_seconds
+              and now - self.changed_at[target] >= self.backoff_seconds):
+            return self._set_rate(target, now, max(self.base_rate, rate / 2))
+        return None
+
+    def _set_rate(self, target, now, rate):
+        if self.budget is not None:
+            others = sum(self.rates.values()) - self.rates[target]
+            rate = max(self.base_rate, min(rate, self.budget - others))
+        if rate == self.rates[target]:
+            return None
+        self.rates[target] = rate
+        self.changed_at[target] = now
+        return rate
@@ -0,0 +1,255 @@
+import bisect
+from collections import deque
+
+
+class LatencySketch:
+    # A log-linear (HDR style) histogram of round-trip times in microseconds. Each power of two is split
+    # into 32 sub-buckets, so any quantile is within ~1.6% of the true value. Counts live in a sparse dict,
+    # which keeps a sketch to a few dozen entries, and two sketches merge by adding their counts.
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+
+    @classmethod
+    def index(cls, microseconds):
+        if microseconds < 2 * cls.SUB_BUCKETS:
+            return microseconds
+        shift = microseconds.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return (shift << cls.SUB_BUCKET_BITS) + (microseconds >> shift)
+
+    @classmethod
+    def value(cls, index):
+        # Midpoint of the range of microsecond values that fall into a bucket
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = (index >> cls.SUB_BUCKET_BITS) - 1
+        mantissa = (index & (cls.SUB_BUCKETS - 1)) + cls.SUB_BUCKETS
+        return ((mantissa << shift) + ((mantissa + 1) << shift)) / 2
+
+    def add(self, rtt):
+        index = self.index(max(0, int(rtt * 1000000)))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        self.merge_counts(other.counts)
+
+    def merge_counts(self, counts):
+        # Add a sketch's counts dict, e.g. one shipped from a worker process
+        for index, count in counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.count += count
+
+    def clear(self):
+        self.counts.clear()
+        self.count = 0
+
+    def quantiles(self, qs):
+        # Round-trip times in seconds for each quantile in qs, or None when the sketch is empty
+        if not self.count:
+            return [None] * len(qs)
+        indexes = sorted(self.counts)
+        results = []
+        for q in qs:
+            rank = max(1, q * self.count)
+            seen = 0
+            for index in indexes:
+                seen += self.counts[index]
+                if seen >= rank:
+                    break
+            results.append(self.value(index) / 1000000)
+        return results
+
+
+class JitterEstimator:
+    # Interarrival jitter as defined in RFC 3550 section 6.4.1, applied to consecutive round-trip times:
+    # J += (|D| - J) / 16
+    def __init__(self):
+        self.jitter = 0.0
+        self.last_rtt = None
+
+    def add(self, rtt):
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+        return self.jitter
+
+
+class RttHistogram:
+    # Cumulative counts of round-trip times in fixed buckets (seconds), the way Prometheus histograms
+    # are exported: counts[i] holds the samples <= bounds[i] and above the bound before it, and the
+    # last entry the ones above every bound
+    BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, rtt):
+        self.counts[bisect.bisect_left(self.bounds, rtt)] += 1
+        self.sum += rtt
+        self.count += 1
+
+    def merge_counts(self, counts, total):
+        # Add another histogram's counts (with the same bounds) and sum
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+            self.count += count
+        self.sum += total
+
+
+class BucketSeries:
+    # Fixed ring of time buckets at one resolution (1s, 1m, 5m). A sample is folded into the running
+    # loss sum/count and latency sketch of its bucket as it arrives, so reading a chart's worth of
+    # buckets costs O(number of bars) no matter how much history has been collected.
+    # A bucket is recycled once its slot comes round again. Loss is averaged with each sample's weight, the
+    # time it stands for, so a bucket half probed at 1/s and half at 50/s still shows the loss over time.
+    def __init__(self, resolution, num_buckets):
+        self.resolution = resolution
+        self.num_buckets = num_buckets
+        self.bucket_ids = [None] * num_buckets
+        self.loss_sum = [0.0] * num_buckets
+        self.loss_count = [0] * num_buckets
+        self.loss_weight = [0.0] * num_buckets
+        self.latency = [LatencySketch() for _ in range(num_buckets)]
+        self.jitter_sum = [0.0] * num_buckets
+        self.jitter_count = [0] * num_buckets
+
+    def bucket_id(self, timestamp):
+        return int(timestamp // self.resolution)
+
+    def _slot(self, bucket_id):
+        slot = bucket_id % self.num_buckets
+        if self.bucket_ids[slot] != bucket_id:
+            self.bucket_ids[slot] = bucket_id
+            self.loss_sum[slot] = 0.0
+            self.loss_count[slot] = 0
+            self.loss_weight[slot] = 0.0
+            self.latency[slot].clear()
+            self.jitter_sum[slot] = 0.0
+            self.jitter_count[slot] = 0
+        return slot
+
+    def add(self, timestamp, packet_loss, rtt=None, jitter=0.0, weight=1.0):
+        slot = self._slot(self.bucket_id(timestamp))
+        self.loss_sum[slot] += packet_loss * weight
+        self.loss_count[slot] += 1
+        self.loss_weight[slot] += weight
+        if rtt is not None:
+            self.latency[slot].add(rtt)
+            self.jitter_sum[slot] += jitter
+            self.jitter_count[slot] += 1
+
+    def add_summary(self, timestamp, loss_sum, loss_count, weight, latency_counts, jitter_sum, jitter_count):
+        # Fold in a whole second's worth of samples pre-aggregated elsewhere (see sharding.py); loss_sum is
+        # already weighted
+        slot = self._slot(self.bucket_id(timestamp))
+        self.loss_sum[slot] += loss_sum
+        self.loss_count[slot] += loss_count
+        self.loss_weight[slot] += weight
+        self.latency[slot].merge_counts(latency_counts)
+        self.jitter_sum[slot] += jitter_sum
+        self.jitter_count[slot] += jitter_count
+
+    def load(self, bucket_ids, loss_sums, loss_counts):
+        # Fill buckets from stored rollups (oldest first), e.g. when restoring history after a restart.
+        # Only loss is restored; latency sketches start again from the new samples.
+        for bucket_id, loss_sum, loss_count in zip(bucket_ids, loss_sums, loss_counts):
+            slot = self._slot(int(bucket_id))
+            self.loss_sum[slot] = float(loss_sum)
+            self.loss_count[slot] = int(loss_count)
+            self.loss_weight[slot] = float(loss_count)
+
+    def history(self, end_bucket_id, count):
+        # Average packet loss of the count buckets before end_bucket_id, newest first, None where there are no samples
+        averages = []
+        for bucket_id in range(end_bucket_id - 1, end_bucket_id - count - 1, -1):
+            slot = bucket_id % self.num_buckets
+            if self.bucket_ids[slot] == bucket_id and self.loss_count[slot]:
+                averages.append(self.loss_sum[slot] / self.loss_weight[slot])
+            else:
+                averages.append(None)
+        return averages
+
+    def bucket_summary(self, bucket_id, qs=(0.5, 0.95, 0.99)):
+        # (samples, average packet loss, latency quantiles, mean jitter) of one bucket, None if it has no samples
+        slot = bucket_id % self.num_buckets
+        if self.bucket_ids[slot] != bucket_id or not self.loss_count[slot]:
+            return None
+        jitter_count = self.jitter_count[slot]
+        return (self.loss_count[slot], self.loss_sum[slot] / self.loss_weight[slot], self.latency[slot].quantiles(qs),
+                self.jitter_sum[slot] / jitter_count if jitter_count else None)
+
+    def latency_summary(self, end_bucket_id, count, qs=(0.5, 0.95, 0.99)):
+        # Merge the buckets in [end_bucket_id - count, end_bucket_id) and return (quantiles, mean jitter)
+        merged = LatencySketch()
+        jitter_sum, jitter_count = 0.0, 0
+        for bucket_id in range(end_bucket_id - count, end_bucket_id):
+            slot = bucket_id % self.num_buckets
+            if self.bucket_ids[slot] == bucket_id:
+                merged.merge(self.latency[slot])
+                jitter_sum += self.jitter_sum[slot]
+                jitter_count += self.jitter_count[slot]
+        return merged.quantiles(qs), (jitter_sum / jitter_count if jitter_count else None)
+
+    def latency_counts(self, end_bucket_id, count):
+        # Copies of what latency_summary merges, ([sketch counts], jitter sum, jitter count), so the merge can
+        # happen after the caller's lock is released (see summarize_latency)
+        counts = []
+        jitter_sum, jitter_count = 0.0, 0
+        for bucket_id in range(end_bucket_id - count, end_bucket_id):
+            slot = bucket_id % self.num_buckets
+            if self.bucket_ids[slot] == bucket_id and self.latency[slot].count:
+                counts.append(self.latency[slot].counts.copy())
+                jitter_sum += self.jitter_sum[slot]
+                jitter_count += self.jitter_count[slot]
+        return counts, jitter_sum, jitter_count
+
+
+def summarize_latency(latency_counts, qs=(0.5, 0.95, 0.99)):
+    # (quantiles, mean jitter) of what BucketSeries.latency_counts copied, like latency_summary
+    counts, jitter_sum, jitter_count = latency_counts
+    merged = LatencySketch()
+    for sketch_counts in counts:
+        merged.merge_counts(sketch_counts)
+    return merged.quantiles(qs), (jitter_sum / jitter_count if jitter_count else None)
+
+
+class SlidingWindow:
+    # Packet loss over the last `seconds`. Samples are appended at the back and expired from the front as
+    # time moves on, with running sums, so both adding a sample and reading the loss are amortised O(1).
+    # Like BucketSeries, the loss is averaged with each sample's weight.
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()
+        self.loss_sum = 0.0
+        self.weight_sum = 0.0
+
+    def add(self, timestamp, packet_loss, weight=1.0):
+        self.samples.append((timestamp, packet_loss * weight, weight))
+        self.loss_sum += packet_loss * weight
+        self.weight_sum += weight
+        self.expire(timestamp)
+
+    def expire(self, now):
+        start_time = now - self.seconds
+        samples = self.samples
+        while samples and samples[0][0] < start_time:
+            _, loss, weight = samples.popleft()
+            self.loss_sum -= loss
+            self.weight_sum -= weight
+        if not samples:
+            # Don't let floating point error build up across refills
+            self.loss_sum = 0.0
+            self.weight_sum = 0.0
+
+    def packet_loss(self, now):
+        self.expire(now)
+        if self.samples:
+            return round(self.loss_sum / self.weight_sum, 2)
+        return 0.0
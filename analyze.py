@@ -0,0 +1,344 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from incidents import (Incident, LOSS_CLOSE, LOSS_MIN_SAMPLES, LOSS_OPEN, LOSS_WINDOW, OUTAGE_SECONDS,
+                       LATENCY_CLOSE, LATENCY_MIN_RISE, LATENCY_OPEN, format_incident)
+from samplestore import LOSS_BY_STATUS, STATUS_REPLY
+from storage import host_directory_name, read_sample_segments, recorded_hosts, sample_weights
+
+QUANTILES = (0.5, 0.95, 0.99)
+RESULT_BY_STATUS = ('0', '100', 'Error')  # Back to the result strings the scheduler reports
+BASELINE_MINUTES = 10  # Latency spikes are judged against the median of this many preceding minutes
+
+
+class Session:
+    # One host's recorded samples as flat arrays: int64 nanosecond timestamps, uint8 statuses, float32
+    # round-trip times (NaN without a reply) and float32 weights, in time order. Loss is averaged with the
+    # weights, so the samples of an --adaptive recording count for the probing time they stand for, as live.
+    def __init__(self, host, timestamps_ns, statuses, rtts, weights):
+        self.host = host
+        self.timestamps_ns = timestamps_ns
+        self.statuses = statuses
+        self.rtts = rtts
+        self.weights = weights
+
+    @classmethod
+    def load(cls, data_dir, host, start=None, end=None):
+        segments = read_sample_segments(os.path.join(data_dir, host_directory_name(host)), start, end)
+        if not segments:
+            return cls(host, np.zeros(0, np.int64), np.zeros(0, np.uint8), np.zeros(0, np.float32),
+                       np.zeros(0, np.float32))
+        # One contiguous array per field rather than the packed records, so every pass below is a straight scan
+        return cls(host, *(np.concatenate([segment[field] for segment in segments])
+                           for field in ('timestamp', 'status', 'rtt')),
+                   np.concatenate([sample_weights(segment) for segment in segments]))
+
+    def __len__(self):
+        return len(self.timestamps_ns)
+
+    @property
+    def start(self):
+        return self.timestamps_ns[0] / 1e9
+
+    @property
+    def end(self):
+        return self.timestamps_ns[-1] / 1e9
+
+
+def bucket_indexes(session, resolution):
+    # (bucket id of the first sample, each sample's bucket counted from there, number of buckets)
+    bucket_ids = session.timestamps_ns // int(resolution * 1e9)
+    first = int(bucket_ids[0])
+    indexes = bucket_ids - first
+    return first, indexes, int(indexes[-1]) + 1
+
+
+def loss_series(session, resolution):
+    # Average packet loss per `resolution`-second bucket over the whole session, the same numbers the
+    # charts' bars show: (bucket start times, loss percentages with NaN for empty buckets, sample counts,
+    # weight sums)
+    first, indexes, num_buckets = bucket_indexes(session, resolution)
+    counts = np.bincount(indexes, minlength=num_buckets)
+    weight_sums = np.bincount(indexes, weights=session.weights, minlength=num_buckets)
+    loss_sums = np.bincount(indexes, weights=LOSS_BY_STATUS[session.statuses] * session.weights,
+                            minlength=num_buckets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        loss = loss_sums / weight_sums
+    return (first + np.arange(num_buckets)) * resolution, loss, counts, weight_sums
+
+
+def rtt_quantiles(session, resolution, quantiles=QUANTILES):
+    # Nearest-rank round-trip time quantiles per bucket, as an array of shape (buckets, quantiles) with NaN
+    # for buckets without replies. One sort of (bucket + scaled rtt) keys groups and orders the replies at once.
+    first, indexes, num_buckets = bucket_indexes(session, resolution)
+    replied = ~np.isnan(session.rtts)
+    indexes = indexes[replied]
+    rtts = session.rtts[replied].astype(np.float64)
+    result = np.full((num_buckets, len(quantiles)), np.nan)
+    if not len(rtts):
+        return result
+
+    scale = float(rtts.max()) * 1.000001 + 1e-12
+    keys = np.sort(indexes + rtts / scale)
+    sorted_rtts = (keys - np.floor(keys)) * scale
+    counts = np.bincount(indexes, minlength=num_buckets)
+    group_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    for column, q in enumerate(quantiles):
+        positions = group_starts[present] + np.floor(q * (counts[present] - 1)).astype(np.int64)
+        result[present, column] = sorted_rtts[positions]
+    return result
+
+
+def hysteresis(opens, closes):
+    # Per step, whether a condition that switches on where opens is true and only off again where closes is
+    # true is on; a forward fill of the last decisive step
+    marks = np.where(opens, 1, np.where(closes, 0, -1))
+    steps = np.arange(len(marks))
+    last_decisive = np.maximum.accumulate(np.where(marks >= 0, steps, -1))
+    return np.where(last_decisive >= 0, marks[np.maximum(last_decisive, 0)], 0) == 1
+
+
+def runs(flags):
+    # (start, stop) index arrays of the runs of True in flags
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def detect_incidents(session):
+    # The incident list the live detector would have produced, with the same thresholds, computed on
+    # one-second steps with array operations: loss bursts and outages from a rolling loss window, latency
+    # spikes from the per-second mean round-trip time against the median of the preceding minutes
+    if not len(session):
+        return []
+    starts, loss, counts, weight_sums = loss_series(session, 1)
+    loss_sums = np.nan_to_num(loss) * weight_sums
+    num_seconds = len(starts)
+    timestamps = session.timestamps_ns
+
+    # Rolling loss over the last LOSS_WINDOW seconds; the sample count is what LOSS_MIN_SAMPLES asks for
+    window_sums = np.cumsum(loss_sums)
+    window_weights = np.cumsum(weight_sums)
+    window_counts = np.cumsum(counts)
+    window_sums[LOSS_WINDOW:] = window_sums[LOSS_WINDOW:] - window_sums[:-LOSS_WINDOW]
+    window_weights[LOSS_WINDOW:] = window_weights[LOSS_WINDOW:] - window_weights[:-LOSS_WINDOW]
+    window_counts[LOSS_WINDOW:] = window_counts[LOSS_WINDOW:] - window_counts[:-LOSS_WINDOW]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        window_loss = window_sums / window_weights
+
+    # Runs of consecutive lost probes lasting OUTAGE_SECONDS are outages, whatever the window says
+    lost = session.statuses != STATUS_REPLY
+    run_starts, run_stops = runs(lost)
+    durations = (timestamps[run_stops - 1] - timestamps[run_starts]) / 1e9
+    outage_starts, outage_stops = run_starts[durations >= OUTAGE_SECONDS], run_stops[durations >= OUTAGE_SECONDS]
+    outage_first_second = (timestamps[outage_starts] // 1_000_000_000 - int(starts[0])).astype(np.int64)
+    outage_last_second = (timestamps[outage_stops - 1] // 1_000_000_000 - int(starts[0])).astype(np.int64)
+    in_outage = np.zeros(num_seconds + 1, np.int64)
+    np.add.at(in_outage, outage_first_second, 1)
+    np.add.at(in_outage, outage_last_second + 1, -1)
+    in_outage = np.cumsum(in_outage)[:num_seconds] > 0
+
+    with np.errstate(invalid='ignore'):
+        loss_on = hysteresis(in_outage | ((window_loss >= LOSS_OPEN) & (window_counts >= LOSS_MIN_SAMPLES)),
+                             ~in_outage & (window_loss <= LOSS_CLOSE))
+
+    # Per-second mean rtt against the median rtt of the BASELINE_MINUTES before the current minute
+    replied = ~np.isnan(session.rtts)
+    second_indexes = timestamps // 1_000_000_000 - int(starts[0])
+    rtt_counts = np.bincount(second_indexes[replied], minlength=num_seconds)
+    rtt_sums = np.bincount(second_indexes[replied], weights=session.rtts[replied], minlength=num_seconds)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fast = rtt_sums / rtt_counts
+    minute_medians = rtt_quantiles(session, 60, (0.5,))[:, 0]
+    padded = np.concatenate((np.full(BASELINE_MINUTES, np.nan), minute_medians))
+    windows = np.lib.stride_tricks.sliding_window_view(padded[:-1], BASELINE_MINUTES)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN windows before the first replies
+        minute_baselines = np.nanmedian(windows, axis=1)
+    minute_of_second = (starts // 60).astype(np.int64) - int(starts[0] // 60)
+    baseline = minute_baselines[minute_of_second]
+    with np.errstate(invalid='ignore'):
+        latency_on = hysteresis((fast >= baseline * LATENCY_OPEN) & (fast - baseline >= LATENCY_MIN_RISE),
+                                fast <= baseline * LATENCY_CLOSE)
+
+    # Sample index ranges and running counts, to fill in each incident's numbers without a loop over samples
+    lost_before = np.concatenate(([0], np.cumsum(lost)))
+    rtts_for_max = np.where(replied, session.rtts, -np.inf)
+    second_bounds = np.searchsorted(second_indexes, np.arange(num_seconds + 1))
+
+    incidents = []
+    for kind, on in (('loss', loss_on), ('latency', latency_on)):
+        for first_second, stop_second in zip(*runs(on)):
+            first_sample, stop_sample = second_bounds[first_second], second_bounds[stop_second]
+            if stop_sample <= first_sample:
+                continue
+            incident_kind = kind
+            if kind == 'loss' and in_outage[first_second:stop_second].any():
+                incident_kind = 'outage'
+            incident = Incident(session.host, incident_kind, timestamps[first_sample] / 1e9)
+            incident.end = (timestamps[stop_sample] / 1e9 if stop_sample < len(timestamps)
+                            else None)  # Still open when the recording ends
+            incident.samples = int(stop_sample - first_sample)
+            incident.lost = int(lost_before[stop_sample] - lost_before[first_sample])
+            worst_loss = window_loss[first_second:stop_second]
+            incident.worst_loss = float(np.nanmax(worst_loss)) if not np.isnan(worst_loss).all() else 0.0
+            worst_rtt = float(rtts_for_max[first_sample:stop_sample].max())
+            incident.worst_rtt = worst_rtt if worst_rtt != -np.inf else None
+            incidents.append(incident)
+    incidents.sort(key=lambda incident: incident.start)
+    return incidents
+
+
+def summarize(session, series_resolutions=(60, 300)):
+    # Everything analyze reports about a session, as plain data
+    replied = session.rtts[~np.isnan(session.rtts)]
+    summary = {
+        'host': session.host,
+        'samples': len(session),
+        'start': session.start,
+        'end': session.end,
+        'loss': float(np.dot(LOSS_BY_STATUS[session.statuses], session.weights) / session.weights.sum()),
+        'rtt_quantiles': dict(zip((f'p{q * 100:g}' for q in QUANTILES),
+                                  (np.quantile(replied, QUANTILES).tolist() if len(replied) else [None] * len(QUANTILES)))),
+        'series': {},
+        'incidents': [incident.to_dict() for incident in detect_incidents(session)],
+    }
+    for resolution in series_resolutions:
+        starts, loss, counts, _ = loss_series(session, resolution)
+        quantiles = rtt_quantiles(session, resolution)
+        summary['series'][str(resolution)] = {
+            'start': starts.tolist(),
+            'loss': [None if np.isnan(value) else value for value in loss.tolist()],
+            'samples': counts.tolist(),
+            **{f'rtt_p{q * 100:g}': [None if np.isnan(value) else value for value in quantiles[:, column].tolist()]
+               for column, q in enumerate(QUANTILES)},
+        }
+    return summary
+
+
+def print_summary(session, summary, worst=5):
+    def when(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    quantiles = summary['rtt_quantiles']
+    latency = ('no replies' if quantiles['p50'] is None else
+               ' / '.join(f'{name} {value * 1000:.1f} ms' for name, value in quantiles.items()))
+    print(f'{session.host}: {len(session)} samples from {when(session.start)} to {when(session.end)}, '
+          f'loss {summary["loss"]:.2f}%, rtt {latency}')
+    starts, loss, counts, _ = loss_series(session, 60)
+    order = np.argsort(np.nan_to_num(loss, nan=-1))[::-1][:worst]
+    worst_minutes = [f'{when(starts[i])} {loss[i]:.1f}%' for i in order if counts[i] and loss[i] > 0]
+    if worst_minutes:
+        print(f'  worst minutes: {", ".join(worst_minutes)}')
+    incidents = [Incident.from_dict(record) for record in summary['incidents']]
+    print(f'  {len(incidents)} incident(s)')
+    for incident in incidents:
+        print(f'    {format_incident(incident)}')
+
+
+def replay(sessions, speed):
+    # Stream the sessions back through the live charts, speed times faster than they were recorded
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+    from gui import NetMonitorPro
+    from synthetic import SimulatedClock
+
+    sessions = [session for session in sessions if len(session)]
+    clock = SimulatedClock(min(session.start for session in sessions))
+    span = max(session.end for session in sessions) - clock.time()
+    rate = max(1, round(max(len(session) for session in sessions) / max(span, 1)))
+
+    app = QApplication(sys.argv)
+    window = NetMonitorPro([session.host for session in sessions], ping_frequency=rate, clock=clock.time, probing=False)
+    window.setWindowTitle(f'ProPing replay ({speed:g}x)')
+    cursors = {session.host: 0 for session in sessions}
+    tick = 0.05  # Seconds of wall time between feeds
+
+    def feed():
+        now_ns = int(clock.advance(tick * speed) * 1e9)
+        batch = []
+        for session in sessions:
+            cursor = cursors[session.host]
+            stop = int(np.searchsorted(session.timestamps_ns, now_ns, side='right'))
+            if stop > cursor:
+                rtts = session.rtts[cursor:stop]
+                batch.extend((session.host, timestamp / 1e9, RESULT_BY_STATUS[status], None if rtt != rtt else rtt,
+                              weight)
+                             for timestamp, status, rtt, weight in zip(session.timestamps_ns[cursor:stop].tolist(),
+                                                                        session.statuses[cursor:stop].tolist(),
+                                                                        rtts.astype(np.float64).tolist(),
+                                                                        session.weights[cursor:stop].tolist()))
+                cursors[session.host] = stop
+        if batch:
+            batch.sort(key=lambda result: result[1])
+            window.update_metrics(batch)
+        if all(cursors[session.host] >= len(session) for session in sessions):
+            timer.stop()
+
+    timer = QTimer(window)
+    timer.timeout.connect(feed)
+    timer.start(int(tick * 1000))
+    window.show()
+    sys.exit(app.exec_())
+
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze or replay the samples proPing recorded with --data-dir.')
+    parser.add_argument('hosts', nargs='*', metavar='host', help='hosts to analyze (default: every recorded host)')
+    parser.add_argument('--data-dir', required=True, metavar='DIR', help='the data directory proPing recorded into')
+    parser.add_argument('--start', type=parse_time, metavar='TIME', help='ignore samples before TIME (ISO 8601)')
+    parser.add_argument('--end', type=parse_time, metavar='TIME', help='ignore samples from TIME on (ISO 8601)')
+    parser.add_argument('--series', type=int, nargs='+', default=[60, 300], metavar='SECONDS',
+                        help='bucket sizes of the loss and rtt series written to --json (default: 60 300)')
+    parser.add_argument('--json', metavar='FILE', help="write the analysis as JSON to FILE ('-' for stdout)")
+    parser.add_argument('--replay', action='store_true', help='play the samples back through the charts instead')
+    parser.add_argument('--speed', type=float, default=60, help='replay speed-up (default: 60)')
+    args = parser.parse_args()
+
+    try:
+        hosts = args.hosts or recorded_hosts(args.data_dir)
+    except OSError as e:
+        print(f'Error: Could not read the data directory: {e}')
+        sys.exit(1)
+    load_start = time.perf_counter()
+    sessions = [Session.load(args.data_dir, host, args.start, args.end) for host in hosts]
+    sessions = [session for session in sessions if len(session)]
+    if not sessions:
+        print('Error: No samples recorded for the given hosts and time range')
+        sys.exit(1)
+
+    if args.replay:
+        replay(sessions, args.speed)
+        return
+
+    summaries = []
+    for session in sessions:
+        summary = summarize(session, args.series)
+        summaries.append(summary)
+        if args.json != '-':
+            print_summary(session, summary)
+    elapsed = time.perf_counter() - load_start
+
+    if args.json == '-':
+        json.dump(summaries, sys.stdout)
+        print()
+    else:
+        print(f'Analyzed {sum(len(session) for session in sessions)} samples in {elapsed:.2f} s')
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump(summaries, json_file)
+
+
+if __name__ == '__main__':
+    main()
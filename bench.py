@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+from monitor import Monitor
+from samplestore import SampleStore, STATUS_LOST, STATUS_REPLY
+from synthetic import LOSS_PATTERNS, SimulatedClock, SyntheticNetwork, synthetic_results
+
+NUM_BARS = 60
+RATE = 10  # Probes per second, the app's default
+HISTORY_SECONDS = 5 * 60 * 60  # ping_results holds 5 hours of samples
+CHECKPOINTS = (0.005, 0.05, 0.125, 0.25, 0.5, 0.75, 1.0)  # Fractions of the run at which a refresh tick is timed
+
+
+def legacy_history(ping_results, now, interval_seconds, num_intervals):
+    # The original update_history: rescan every stored sample for each of the chart's intervals
+    end = int(now // interval_seconds) * interval_seconds
+    new_history = []
+    for i in range(num_intervals):
+        interval_end_timestamp = end - i * interval_seconds
+        interval_start_timestamp = interval_end_timestamp - interval_seconds
+        interval_data = [loss for timestamp, loss, rtt in ping_results if
+                         interval_start_timestamp <= timestamp < interval_end_timestamp]
+        new_history.append(sum(interval_data) / len(interval_data) if interval_data else None)
+    return new_history
+
+
+def time_call(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def refresh_tick(state, now):
+    # What a front end reads about a host every second: the 1s/1m/5m bars with their latency summaries,
+    # and recent packet loss
+    for bucket_series in state.buckets_by_interval.values():
+        end_bucket_id = bucket_series.bucket_id(now)
+        bucket_series.history(end_bucket_id, NUM_BARS)
+        bucket_series.latency_summary(end_bucket_id, NUM_BARS)
+    for seconds in (1, 10, 60):
+        state.calculate_packet_loss(seconds, now)
+
+
+def make_networks(args, targets):
+    return {target: SyntheticNetwork(args.seed + i, args.loss_pattern, args.loss, args.rtt_median, args.rtt_sigma,
+                                     args.spike_rate)
+            for i, target in enumerate(targets)}
+
+
+def fill_monitor(args, rate, on_batch=None):
+    # Fast-forward args.hours of synthetic probing of args.targets hosts into a Monitor on a simulated clock
+    targets = [f'target-{i}' for i in range(args.targets)]
+    clock = SimulatedClock()
+    monitor = Monitor(targets, ping_frequency=rate, history_minutes=args.history)
+    for batch in synthetic_results(targets, rate, args.hours * 3600, clock, make_networks(args, targets)):
+        if on_batch is None:
+            monitor.ingest_batch(batch)
+        else:
+            on_batch(monitor, clock, batch)
+    return monitor
+
+
+def peak_rss():
+    # Peak resident set size of this process so far, in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+
+def bench_ingest(args, rate, report):
+    # Per-sample ingest cost and the per-tick refresh cost as history fills up. The bucket reads grow only
+    # until all 60 bars of the 5m chart hold data (5 hours), then stay flat.
+    start = SimulatedClock().time()
+    checkpoints = deque(args.hours * 3600 * fraction for fraction in CHECKPOINTS)
+    legacy_results = deque(maxlen=int(HISTORY_SECONDS * rate)) if args.legacy else None
+    rows = []
+    totals = {'samples': 0, 'ingest_time': 0.0}
+    segment = {'samples': 0, 'ingest_time': 0.0}  # Since the last checkpoint
+
+    report(f'{"history":>10} {"samples":>10} {"ingest/sample":>14} {"tick":>10}'
+           + (f' {"tick (rescan)":>14}' if args.legacy else ''))
+
+    def on_batch(monitor, clock, batch):
+        batch_start = time.perf_counter()
+        monitor.ingest_batch(batch)
+        elapsed = time.perf_counter() - batch_start
+        for counts in (totals, segment):
+            counts['samples'] += len(batch)
+            counts['ingest_time'] += elapsed
+        if legacy_results is not None:
+            legacy_results.extend((timestamp, 0.0 if rtt is not None else 100.0, rtt)
+                                  for target, timestamp, result, rtt, _ in batch if target == 'target-0')
+
+        if not checkpoints or clock.now - start < checkpoints[0]:
+            return
+        checkpoints.popleft()
+        now = clock.now
+        state = monitor.target_states['target-0']
+        row = {
+            'history_seconds': round(now - start),
+            'samples': totals['samples'],
+            'ingest_us_per_sample': segment['ingest_time'] / segment['samples'] * 1e6,
+            'tick_ms': time_call(lambda: refresh_tick(state, now), args.repeat) * 1e3,
+        }
+        line = (f'{row["history_seconds"] / 60:>8.0f} m {row["samples"]:>10} {row["ingest_us_per_sample"]:>11.2f} us'
+                f' {row["tick_ms"]:>7.3f} ms')
+        if legacy_results is not None:
+            row['legacy_tick_ms'] = time_call(
+                lambda: [legacy_history(legacy_results, now, interval, NUM_BARS) for interval in (1, 60, 300)], 1) * 1e3
+            line += f' {row["legacy_tick_ms"]:>11.1f} ms'
+        report(line)
+        rows.append(row)
+        segment['samples'] = 0
+        segment['ingest_time'] = 0.0
+
+    rss_before = peak_rss()
+    monitor = fill_monitor(args, rate, on_batch)
+    rss_growth = peak_rss() - rss_before
+    store_bytes = sum(state.ping_results.nbytes for state in monitor.target_states.values())
+    report(f'memory: peak RSS grew {rss_growth / 1e6:.1f} MB while filling, sample stores hold {store_bytes / 1e6:.1f} MB')
+    return {'checkpoints': rows, 'samples': totals['samples'],
+            'ingest_us_per_sample': totals['ingest_time'] / max(1, totals['samples']) * 1e6,
+            'peak_rss_growth_bytes': rss_growth, 'sample_store_bytes': store_bytes}
+
+
+def bench_memory(report):
+    # Memory for 5 hours of 10 Hz samples: the old deque of (timestamp, loss, rtt) tuples against SampleStore
+    rng = random.Random(1)
+    num_samples = HISTORY_SECONDS * RATE
+    samples = [(1700000000.0 + i / RATE, rng.random() < 0.02, rng.lognormvariate(-4, 0.3)) for i in range(num_samples)]
+
+    tracemalloc.start()
+    ping_results = deque(maxlen=num_samples)
+    for timestamp, lost, rtt in samples:
+        ping_results.append((timestamp, 100.0 if lost else 0.0, None if lost else rtt))
+    deque_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del ping_results
+
+    store = SampleStore(num_samples)
+    start = time.perf_counter()
+    for timestamp, lost, rtt in samples:
+        store.append(timestamp, STATUS_LOST if lost else STATUS_REPLY, None if lost else rtt)
+    append_time = (time.perf_counter() - start) / num_samples
+
+    report(f'{num_samples} samples: deque of tuples {deque_bytes / 1e6:.1f} MB, '
+           f'SampleStore {store.nbytes / 1e6:.1f} MB ({deque_bytes / store.nbytes:.0f}x smaller), '
+           f'{append_time * 1e6:.2f} us per append')
+    return {'samples': num_samples, 'deque_bytes': deque_bytes, 'sample_store_bytes': store.nbytes,
+            'append_us': append_time * 1e6}
+
+
+def bench_render(frames, report):
+    # Frame time of the packet loss charts: the old per-second update (set heights, set_ylim,
+    # tight_layout and a full canvas draw) against PacketLossChart, which blits the bars over a cached
+    # background, and of the mini-graph. Runs on Qt's offscreen platform unless QT_QPA_PLATFORM says otherwise.
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtGui import QImage
+    from PyQt5.QtWidgets import QApplication
+    from gui import PacketLossChart, PacketLossGraph
+
+    app = QApplication.instance() or QApplication([])
+    rng = random.Random(1)
+    histories = [[rng.choice((0.0, 0.0, 0.0, 10.0, 20.0)) for _ in range(NUM_BARS)] for _ in range(frames)]
+
+    def percentiles(times):
+        times.sort()
+        return {'median_ms': times[len(times) // 2] * 1e3, 'p95_ms': times[int(len(times) * 0.95)] * 1e3}
+
+    def run(update):
+        chart = PacketLossChart(NUM_BARS)
+        chart.canvas.resize(500, 400)
+        chart.canvas.show()
+        chart.canvas.draw()
+        app.processEvents()
+        times = []
+        for history in histories:
+            start = time.perf_counter()
+            update(chart, history)
+            app.processEvents()
+            times.append(time.perf_counter() - start)
+        chart.canvas.close()
+        return percentiles(times)
+
+    def legacy_update(chart, history):
+        for rect, h in zip(chart.bar_plots[0], history):
+            rect.set_height(h)
+        chart.axes[0].set_ylim(0, max(history) + 1)
+        chart.figure.tight_layout(pad=3.0, h_pad=1.5, w_pad=1.0)
+        chart.canvas.draw()
+
+    def blit_update(chart, history):
+        chart.set_history(0, history)
+
+    results = {}
+    for name, update in (('full_redraw', legacy_update), ('blit', blit_update)):
+        results[name] = run(update)
+        report(f'{name:>12}: {results[name]["median_ms"]:7.2f} ms median, {results[name]["p95_ms"]:7.2f} ms p95 '
+               f'per frame ({frames} frames)')
+
+    # The mini-graph with a long history: one point added and the widget painted per frame
+    graph = PacketLossGraph(num_points=3600)
+    graph.resize(400, 200)
+    image = QImage(400, 200, QImage.Format_ARGB32)
+    for _ in range(3600):
+        graph.add_data_point(rng.choice((0.0, 0.0, 10.0)))
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        graph.add_data_point(rng.choice((0.0, 0.0, 10.0)))
+        graph.render(image)
+        times.append(time.perf_counter() - start)
+    results['mini_graph'] = percentiles(times)
+    report(f'{"mini_graph":>12}: {results["mini_graph"]["median_ms"]:7.2f} ms median, '
+           f'{results["mini_graph"]["p95_ms"]:7.2f} ms p95 per frame (3600 points)')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the proPing monitoring core, fed by a '
+                                                 'deterministic synthetic probe source on a simulated clock.')
+    parser.add_argument('--hours', type=float, default=10, help='hours of probing to fast-forward (default: 10)')
+    parser.add_argument('--rate', type=float, nargs='+', default=[RATE], metavar='RATE',
+                        help='probes per second per target; several rates are benchmarked one after another')
+    parser.add_argument('--targets', type=int, default=1, help='number of synthetic targets (default: 1)')
+    parser.add_argument('--history', type=float, metavar='MINUTES',
+                        help='minutes of raw samples kept per target (default: as the app)')
+    parser.add_argument('--loss-pattern', choices=LOSS_PATTERNS, default='random')
+    parser.add_argument('--loss', type=float, default=0.02, help='long-run loss probability (default: 0.02)')
+    parser.add_argument('--rtt-median', type=float, default=0.02, metavar='SECONDS')
+    parser.add_argument('--rtt-sigma', type=float, default=0.3, help='log-normal sigma of the round-trip time')
+    parser.add_argument('--spike-rate', type=float, default=0.0, help='chance of a 10x slower reply')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20, help='timing repetitions, the best run is reported')
+    parser.add_argument('--legacy', action='store_true',
+                        help='also time the old full-rescan update_history and deque storage for comparison (slow)')
+    parser.add_argument('--render', action='store_true',
+                        help='also time GUI frames: full matplotlib redraw against blitting, and the mini-graph '
+                             '(needs PyQt5)')
+    parser.add_argument('--frames', type=int, default=200, help='frames drawn by the render benchmark')
+    parser.add_argument('--json', metavar='FILE',
+                        help="write the results as JSON to FILE ('-' for stdout, which replaces the tables)")
+    args = parser.parse_args()
+
+    quiet = args.json == '-'
+
+    def report(line=''):
+        if not quiet:
+            print(line)
+
+    results = {'scenario': {name: value for name, value in vars(args).items() if name != 'json'}, 'runs': []}
+    for rate in args.rate:
+        report(f'{args.targets} target(s) at {rate:g} probes/s for {args.hours:g} h, {args.loss_pattern} loss')
+        results['runs'].append({'rate': rate, **bench_ingest(args, rate, report)})
+        report()
+    if args.legacy:
+        results['sample_memory'] = bench_memory(report)
+    if args.render:
+        report()
+        results['render'] = bench_render(args.frames, report)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
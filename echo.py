@@ -0,0 +1,134 @@
+import argparse
+import random
+import selectors
+import socket
+import threading
+
+# Local stand-ins for the far end of the tcp and udp probes: a UDP echo server that sends every datagram
+# back, and a TCP server that accepts connections and echoes whatever arrives on them. They run on a
+# background thread, so the self-test (or anything else) can probe them from the same process. The UDP
+# server can drop a fraction of the datagrams (loss) to simulate a bad link; TCP handshakes are completed by
+# the kernel before we ever see them, so there is no such knob for TCP.
+
+
+class EchoServer:
+    sock_type = None
+
+    def __init__(self, address='127.0.0.1', port=0, family=socket.AF_INET, loss=0.0, seed=None):
+        self.sock = socket.socket(family, self.sock_type)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((address, port))
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+        self.running = False
+        self.handled = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+    def run(self):
+        self.selector.register(self.sock, selectors.EVENT_READ, self._on_readable)
+        try:
+            while self.running:
+                for key, _ in self.selector.select(0.1):
+                    key.data(key.fileobj)
+        finally:
+            for key in list(self.selector.get_map().values()):
+                key.fileobj.close()
+            self.selector.close()
+
+    def _dropped(self):
+        return self.loss and self.rng.random() < self.loss
+
+
+class UdpEchoServer(EchoServer):
+    sock_type = socket.SOCK_DGRAM
+
+    def _on_readable(self, sock):
+        while True:
+            try:
+                data, sender = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # An ICMP error for an earlier reply
+            self.handled += 1
+            if not self._dropped():
+                try:
+                    sock.sendto(data, sender)
+                except OSError:
+                    pass
+
+
+class TcpEchoServer(EchoServer):
+    sock_type = socket.SOCK_STREAM
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sock.listen(socket.SOMAXCONN)
+
+    def _on_readable(self, sock):
+        if sock is not self.sock:
+            self._echo(sock)
+            return
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            self.handled += 1
+            conn.setblocking(False)
+            self.selector.register(conn, selectors.EVENT_READ, self._on_readable)
+
+    def _echo(self, conn):
+        try:
+            data = conn.recv(4096)
+            if data:
+                conn.sendall(data)
+                return
+        except OSError:
+            pass
+        self.selector.unregister(conn)
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Echo servers for trying out the tcp and udp probes.')
+    parser.add_argument('--address', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--tcp', type=int, metavar='PORT', help='run the TCP echo server on PORT')
+    parser.add_argument('--udp', type=int, metavar='PORT', help='run the UDP echo server on PORT')
+    parser.add_argument('--loss', type=float, default=0.0, help='fraction of UDP datagrams to drop (default: 0)')
+    args = parser.parse_args()
+    if args.tcp is None and args.udp is None:
+        parser.error('give --tcp and/or --udp')
+
+    family = socket.AF_INET6 if ':' in args.address else socket.AF_INET
+    servers = []
+    if args.tcp is not None:
+        servers.append(TcpEchoServer(args.address, args.tcp, family).start())
+    if args.udp is not None:
+        servers.append(UdpEchoServer(args.address, args.udp, family, args.loss).start())
+    for server in servers:
+        print(f'{type(server).__name__} listening on {args.address} port {server.port}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from samplestore import STATUS_REPLY, STATUS_LOST, STATUS_ERROR
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # Prometheus text exposition format
+RESULT_LABELS = {STATUS_REPLY: 'reply', STATUS_LOST: 'lost', STATUS_ERROR: 'error'}
+LOSS_WINDOWS = (10, 60)  # Seconds of recent packet loss exported as gauges
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def snapshot_target(state, current_time, probe_rate=None):
+    # Copy the numbers one host exports. Everything comes from aggregates kept up to date on ingest, so
+    # this is O(1) per host and the caller holds the monitor lock only briefly.
+    histogram = state.rtt_histogram
+    return {
+        'host': state.host,
+        'probe_counts': list(state.probe_counts),
+        'loss': {seconds: state.calculate_packet_loss(seconds, current_time) / 100 for seconds in LOSS_WINDOWS},
+        'rtt_bounds': histogram.bounds,
+        'rtt_counts': list(histogram.counts),
+        'rtt_sum': histogram.sum,
+        'rtt_count': histogram.count,
+        'jitter': state.jitter_estimator.jitter,
+        'dns_time': state.dns_time,
+        'dns_ok': state.dns_error is None and state.address is not None,
+        'dns_failures': state.dns_failures,
+        'probe_rate': probe_rate,
+    }
+
+
+def format_metrics(snapshots):
+    lines = []
+
+    def family(name, metric_type, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+    family('proping_probes_total', 'counter', 'Probes sent, by result.')
+    for snapshot in snapshots:
+        target = escape_label(snapshot['host'])
+        for status, count in enumerate(snapshot['probe_counts']):
+            lines.append(f'proping_probes_total{{target="{target}",result="{RESULT_LABELS[status]}"}} {count}')
+
+    family('proping_probe_rate', 'gauge', 'Probes currently sent per second to the target.')
+    for snapshot in snapshots:
+        if snapshot['probe_rate'] is not None:
+            lines.append(f'proping_probe_rate{{target="{escape_label(snapshot["host"])}"}} {snapshot["probe_rate"]:g}')
+
+    family('proping_packet_loss_ratio', 'gauge', 'Fraction of probes lost over the most recent window.')
+    for snapshot in snapshots:
+        target = escape_label(snapshot['host'])
+        for seconds, loss in snapshot['loss'].items():
+            lines.append(f'proping_packet_loss_ratio{{target="{target}",window="{seconds}s"}} {loss:.6g}')
+
+    family('proping_rtt_seconds', 'histogram', 'Round-trip time of answered probes.')
+    for snapshot in snapshots:
+        target = escape_label(snapshot['host'])
+        cumulative = 0
+        for bound, count in zip(snapshot['rtt_bounds'], snapshot['rtt_counts']):
+            cumulative += count
+            lines.append(f'proping_rtt_seconds_bucket{{target="{target}",le="{bound:g}"}} {cumulative}')
+        lines.append(f'proping_rtt_seconds_bucket{{target="{target}",le="+Inf"}} {snapshot["rtt_count"]}')
+        lines.append(f'proping_rtt_seconds_sum{{target="{target}"}} {snapshot["rtt_sum"]:.9g}')
+        lines.append(f'proping_rtt_seconds_count{{target="{target}"}} {snapshot["rtt_count"]}')
+
+    family('proping_jitter_seconds', 'gauge', 'RFC 3550 interarrival jitter of the round-trip time.')
+    for snapshot in snapshots:
+        lines.append(f'proping_jitter_seconds{{target="{escape_label(snapshot["host"])}"}} {snapshot["jitter"]:.9g}')
+
+    family('proping_dns_lookup_seconds', 'gauge', 'Time the last successful lookup of the target took.')
+    for snapshot in snapshots:
+        if snapshot['dns_time'] is not None:
+            lines.append(f'proping_dns_lookup_seconds{{target="{escape_label(snapshot["host"])}"}} '
+                         f'{snapshot["dns_time"]:.9g}')
+
+    family('proping_dns_up', 'gauge', '1 if the last lookup of the target succeeded, else 0.')
+    for snapshot in snapshots:
+        lines.append(f'proping_dns_up{{target="{escape_label(snapshot["host"])}"}} {int(snapshot["dns_ok"])}')
+
+    family('proping_dns_failures_total', 'counter', 'Failed lookups of the target.')
+    for snapshot in snapshots:
+        lines.append(f'proping_dns_failures_total{{target="{escape_label(snapshot["host"])}"}} '
+                     f'{snapshot["dns_failures"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def render_metrics(monitor, current_time=None):
+    if current_time is None:
+        current_time = time.time()
+    with monitor.lock:
+        snapshots = [snapshot_target(state, current_time, monitor.probe_rate(host))
+                     for host, state in monitor.target_states.items()]
+    # Formatting happens outside the lock, so a scrape never holds up ingesting
+    return format_metrics(snapshots)
+
+
+class MetricsExporter:
+    # Serves the monitor's aggregates at http://address:port/metrics for Prometheus to scrape, from its own
+    # threads, so a slow scraper never blocks the probe scheduler or the GUI
+    def __init__(self, monitor, port, address='127.0.0.1'):
+        self.monitor = monitor
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = render_metrics(exporter.monitor).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # One line per scrape is just noise
+
+        try:
+            self.server = ThreadingHTTPServer((address, port), Handler)
+        except OSError as e:
+            raise OSError(f'Could not serve metrics on {address}:{port}: {e}') from e
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsExporter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.server.shutdown()  # Waits for serve_forever to return, so only once it has been started
+            self.thread.join()
+            self.thread = None
+        self.server.server_close()
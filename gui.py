@@ -0,0 +1,841 @@
+import time
+import datetime
+import warnings
+import numpy as np
+from collections import deque
+from PyQt5.QtWidgets import QSizePolicy,  QHBoxLayout, QWidget, QLabel, QGridLayout, QScrollArea
+from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout
+from PyQt5.QtCore import Qt, QSize, QTimer
+from PyQt5.QtCore import pyqtSignal, QEvent
+from PyQt5.QtGui import QPainter, QColor, QFont, QPen, QPolygonF
+from monitor import Monitor, ResultQueue, format_dns
+from incidents import format_incident
+from instrumentation import falling_behind, format_instrumentation
+
+FRAME_INTERVAL = 1 / 30  # Probe results are ingested at most this often, in one batch
+
+
+def set_text(label, text):
+    # Only touch the label when what it shows changes, so an unchanged label is never laid out or repainted
+    if label.text() != text:
+        label.setText(text)
+
+
+class PacketLossGraph(QWidget):
+    # Scrolling line of the recent packet loss values, newest at the left, drawn over the indicator.
+    # The values live in a fixed ring buffer, and paintEvent fills one preallocated polygon from it with
+    # NumPy and draws it as a single polyline, so adding a point allocates nothing and costs the same
+    # with thousands of points as with a hundred. The line is scaled to whatever size the widget has.
+    def __init__(self, parent=None, num_points=120):
+        super().__init__(parent)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.setMinimumSize(20, 20)
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)  # Clicks go to the indicator underneath
+
+        self.num_points = num_points
+        self.values = np.zeros(num_points)
+        self.head = 0  # Where the next value goes
+        self.count = 0
+        self.offsets = np.arange(num_points)  # Age of each polygon point, 0 is the newest
+
+        # A QPolygonF whose point storage is shared with a NumPy (num_points, 2) array of x, y
+        self.polygon = QPolygonF(num_points)
+        points = self.polygon.data()
+        points.setsize(num_points * 2 * 8)
+        self.points = np.frombuffer(points, dtype=np.float64).reshape(num_points, 2)
+
+        self.pen = QPen(QColor("black"), 1)
+
+    def add_data_point(self, packet_loss):
+        self.values[self.head] = packet_loss
+        self.head = (self.head + 1) % self.num_points
+        self.count = min(self.count + 1, self.num_points)
+        self.update()
+
+    def paintEvent(self, event):
+        if self.count < 2:
+            return
+        height = self.height() - 20  # Leave room at the bottom, as the original graph did
+        step = self.width() / (self.num_points - 1)
+
+        # Points older than what has been recorded so far collapse onto the oldest value
+        ages = np.minimum(self.offsets, self.count - 1)
+        self.points[:, 0] = ages * step
+        self.points[:, 1] = height - self.values[(self.head - 1 - ages) % self.num_points] / 100 * height
+
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.pen)
+        painter.drawPolyline(self.polygon)
+
+
+class PacketLossIndicator(QWidget):
+    clicked = pyqtSignal()
+
+    def __init__(self, parent=None, with_graph=True):
+        super().__init__(parent)
+        self.packet_loss = 0
+        self.current_color = self.get_color_based_on_packet_loss(self.packet_loss)
+
+        # Set size policy to be expandable but maintain aspect ratio
+        sizePolicy = QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        sizePolicy.setHeightForWidth(True)
+        self.setSizePolicy(sizePolicy)
+
+        # The overview tiles skip the mini-graph, there can be hundreds of them
+        self.packet_loss_graph = PacketLossGraph(self) if with_graph else None
+        layout = QVBoxLayout(self)
+        if self.packet_loss_graph is not None:
+            layout.addWidget(self.packet_loss_graph)
+        self.setLayout(layout)
+
+    def set_packet_loss(self, packet_loss):
+        new_color = self.get_color_based_on_packet_loss(packet_loss)
+        if new_color != self.current_color:
+            self.packet_loss = packet_loss
+            self.current_color = new_color
+            self.update()
+        if self.packet_loss_graph is not None:
+            self.packet_loss_graph.add_data_point(packet_loss)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.clicked.emit()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(self.current_color))
+
+    def resizeEvent(self, event):
+        # Ensure the widget maintains a square shape
+        size = min(self.width(), self.height())
+        self.setFixedSize(size, size)
+
+    def get_color_based_on_packet_loss(self, packet_loss):
+        # Define RGB values for yellow, orange, red, and grey
+        yellow = (255, 255, 0)
+        orange = (255, 165, 0)
+        red = (255, 0, 0)
+        grey = (169, 169, 169)
+
+        def interpolate(color1, color2, factor):
+            # Interpolate between two colors
+            return tuple(int(a + (b - a) * factor) for a, b in zip(color1, color2))
+
+        def mix_with_grey(color, factor):
+            # Mix a color with grey to reduce saturation
+            return interpolate(color, grey, factor)
+
+        if packet_loss >= 30:
+            color = red
+        elif packet_loss >= 10:
+            # Smooth transition from orange to red
+            color = interpolate(orange, red, (packet_loss - 10) / 20)
+        elif packet_loss >= 3:
+            # Smooth transition from yellow to orange
+            color = interpolate(yellow, orange, (packet_loss - 3) / 7)
+        else:
+            color = grey
+
+        # Mix the chosen color with grey to reduce saturation
+        less_saturated_color = mix_with_grey(color, 0.3)  # 30% grey
+
+        # Convert to hex color code
+        return f'#{less_saturated_color[0]:02x}{less_saturated_color[1]:02x}{less_saturated_color[2]:02x}'
+
+class HeartbeatIndicator(QWidget):
+    # Blinks once a second while results keep coming in
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.active_color = QColor("lightgrey")
+        self.setFixedSize(10, 10)  # Fixed size for the heartbeat indicator
+
+    def toggle_color(self):
+        if self.active_color.name() == QColor("darkgrey").name():
+            self.active_color = QColor("lightgrey")
+        else:
+            self.active_color = QColor("darkgrey")
+        self.update()  # Trigger a repaint
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.active_color)
+
+
+class TargetTile(QWidget):
+    clicked = pyqtSignal(str)
+
+    def __init__(self, host, parent=None):
+        super().__init__(parent)
+        self.host = host
+
+        self.indicator = PacketLossIndicator(self, with_graph=False)
+        self.indicator.setFixedSize(40, 40)
+        self.indicator.clicked.connect(lambda: self.clicked.emit(self.host))
+
+        self.name_label = QLabel(host, self)
+        self.name_label.setAlignment(Qt.AlignCenter)
+        self.name_label.setFixedWidth(80)
+        font = QFont()
+        font.setPointSize(8)
+        self.name_label.setFont(font)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(2, 2, 2, 2)
+        layout.setSpacing(1)
+        layout.addWidget(self.indicator, 0, Qt.AlignCenter)
+        layout.addWidget(self.name_label)
+
+    def set_packet_loss(self, packet_loss):
+        self.indicator.set_packet_loss(packet_loss)
+        tool_tip = f'{self.host}: {packet_loss:.1f}% packet loss'
+        if tool_tip != self.toolTip():
+            self.setToolTip(tool_tip)
+
+    def set_selected(self, selected):
+        font = self.name_label.font()
+        font.setBold(selected)
+        self.name_label.setFont(font)
+
+
+class TargetOverview(QScrollArea):
+    # A grid of small packet loss tiles, one per monitored host. Clicking a tile shows that host in the charts.
+    target_selected = pyqtSignal(str)
+
+    def __init__(self, hosts, columns=6, parent=None):
+        super().__init__(parent)
+        self.setWidgetResizable(True)
+        self.setMaximumHeight(200)
+
+        grid_widget = QWidget(self)
+        grid_layout = QGridLayout(grid_widget)
+        grid_layout.setSpacing(2)
+        self.tiles = {}
+        for n, host in enumerate(hosts):
+            tile = TargetTile(host, grid_widget)
+            tile.clicked.connect(self.target_selected)
+            grid_layout.addWidget(tile, n // columns, n % columns)
+            self.tiles[host] = tile
+        self.setWidget(grid_widget)
+
+    def set_selected(self, host):
+        for tile_host, tile in self.tiles.items():
+            tile.set_selected(tile_host == host)
+
+
+class PathView(QLabel):
+    # The selected host's route in path mode, one line per router like mtr. Loss that starts at a hop and
+    # carries on to every hop after it is on that link; loss at one hop alone is usually just the router
+    # rate limiting its replies.
+    HEADER = f'{"Hop":>3}  {"Address":<24} {"Loss 10s":>8} {"60s":>6} {"p50 ms":>7}'
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        font = QFont('Monospace')
+        font.setStyleHint(QFont.TypeWriter)
+        font.setPointSize(9)
+        self.setFont(font)
+
+    def set_rows(self, rows):
+        # rows of (hop number, address, 10 s loss, 60 s loss, median round trip in seconds or None)
+        lines = [self.HEADER]
+        for ttl, address, loss_10s, loss_60s, p50 in rows:
+            latency = f'{p50 * 1000:7.1f}' if p50 is not None else f'{"-":>7}'
+            lines.append(f'{ttl:>3}  {address or "?":<24} {loss_10s:7.1f}% {loss_60s:5.1f}% {latency}')
+        set_text(self, '\n'.join(lines))
+
+
+class PacketLossChart:
+    # The three packet loss bar charts. The layout is computed once per canvas size, and the bars are
+    # animated artists: a full draw caches each subplot's static background (axes, ticks, titles), and
+    # an update restores that background and blits only the bars of the subplot whose data changed.
+    # A full redraw is needed only when a subplot's y-axis limit changes, and limits snap to a few
+    # fixed values so that is rare.
+    Y_LIMITS = (1, 2, 5, 11, 26, 51, 101)
+    TITLES = ("1-Second Intervals", "1-Minute Intervals", "5-Minute Intervals")
+    COLORS = ('b', 'g', 'r')
+
+    def __init__(self, num_of_bars_in_chart):
+        # matplotlib is imported here, after the window is up, since importing it is a good part of startup.
+        # A plain Figure rather than pyplot, so no pyplot window manager is created behind our back.
+        import matplotlib.ticker as ticker
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        self.figure = Figure(figsize=(5, 4))
+        self.axes = self.figure.subplots(3, 1)
+        self.canvas = FigureCanvas(self.figure)
+
+        self.bar_plots = []
+        for ax, title, color in zip(self.axes, self.TITLES, self.COLORS):
+            bars = ax.bar(range(num_of_bars_in_chart), [0] * num_of_bars_in_chart, color=color)
+            for rect in bars:
+                rect.set_animated(True)
+            self.bar_plots.append(bars)
+            ax.set_title(title)
+            ax.set_ylim(0, self.Y_LIMITS[0])
+            # Three y-axis ticks: zero, the middle and the top
+            ax.yaxis.set_major_locator(ticker.LinearLocator(numticks=3))
+
+        self.heights = [None] * len(self.axes)
+        self.y_limits = [self.Y_LIMITS[0]] * len(self.axes)
+        self.backgrounds = None
+
+        # Laid out when the canvas gets its size, which it always does before it is first drawn
+        self.canvas.mpl_connect('resize_event', lambda event: self.apply_layout())
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def apply_layout(self):
+        # Apply tight_layout with increased padding. When the window is too short for all three titles
+        # (e.g. under a large target overview) matplotlib keeps the previous layout and warns; that is fine.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            self.figure.tight_layout(pad=3.0, h_pad=1.5, w_pad=1.0)  # Adjust padding as needed
+
+    def _on_draw(self, event):
+        # A full draw just happened: cache the static backgrounds, then put the animated bars on top
+        self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+        for ax, bars in zip(self.axes, self.bar_plots):
+            for rect in bars:
+                ax.draw_artist(rect)
+
+    def set_history(self, index, history):
+        heights = [0 if x is None else x for x in history]
+        if heights == self.heights[index]:
+            return  # Nothing changed, nothing to draw
+        self.heights[index] = heights
+
+        ax, bars = self.axes[index], self.bar_plots[index]
+        for rect, h in zip(bars, heights):
+            rect.set_height(h)
+
+        y_limit = next((limit for limit in self.Y_LIMITS if limit >= max(heights) + 1), self.Y_LIMITS[-1])
+        if y_limit != self.y_limits[index] or self.backgrounds is None:
+            # The ticks change (or nothing has been drawn yet), so the whole figure needs drawing
+            self.y_limits[index] = y_limit
+            ax.set_ylim(0, y_limit)  # Adjust y-axis
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self.backgrounds[index])
+        for rect in bars:
+            ax.draw_artist(rect)
+        self.canvas.blit(ax.bbox)
+
+
+class NetMonitorPro(QMainWindow):
+    DEBUG_OVERLAY_STYLE = "background-color: rgba(255, 255, 255, 220); color: {color}; padding: 4px; font-size: 11px;"
+
+    def __init__(self, ping_hosts, probe_backend='auto', ping_frequency=10, history_minutes=None,
+                 data_dir=None, retention_days=None, family=None, dns_refresh=None, metrics_port=None,
+                 metrics_address=None, debug_overlay=False, clock=None, probing=True, probe_port=None,
+                 adaptive=False, burst_rate=None, rate_budget=None, workers=1, path=False, stream_path=None,
+                 stream_port=None, stream_address=None, launch_time=None, addresses=None):
+        super().__init__()
+        # Startup is timed from launch_time (a time.perf_counter() reading) to the first frame on screen
+        self.launch_time = launch_time if launch_time is not None else time.perf_counter()
+        self.first_frame_seconds = None
+        self.chart_ready_seconds = None
+        if isinstance(ping_hosts, str):
+            ping_hosts = [ping_hosts]
+        self.ping_hosts = list(ping_hosts)
+        self.ping_frequency = ping_frequency
+
+        # The monitoring core probes and aggregates. Results are queued by the scheduler thread and
+        # ingested in batches on the GUI thread, with one posted event per batch rather than per result.
+        self.result_queue = ResultQueue(self.wrapper_update_metrics)
+        self.last_drain = 0.0
+        monitor_options = {'data_dir': data_dir}
+        if retention_days is not None:
+            monitor_options['retention_days'] = retention_days
+        if family is not None:
+            monitor_options['family'] = family
+        if dns_refresh is not None:
+            monitor_options['dns_refresh'] = dns_refresh
+        if metrics_port is not None:
+            monitor_options['metrics_port'] = metrics_port
+        if metrics_address is not None:
+            monitor_options['metrics_address'] = metrics_address
+        if probe_port is not None:
+            monitor_options['probe_port'] = probe_port
+        if workers > 1:
+            monitor_options['workers'] = workers
+        if path:
+            monitor_options['path'] = True
+        if stream_path is not None:
+            monitor_options['stream_path'] = stream_path
+        if stream_port is not None:
+            monitor_options['stream_port'] = stream_port
+        if stream_address is not None:
+            monitor_options['stream_address'] = stream_address
+        if addresses is not None:
+            monitor_options['addresses'] = addresses
+        if adaptive:
+            monitor_options['adaptive'] = True
+            monitor_options['rate_budget'] = rate_budget
+            if burst_rate is not None:
+                monitor_options['burst_rate'] = burst_rate
+        self.monitor = Monitor(self.ping_hosts, probe_backend, ping_frequency, history_minutes,
+                               on_result=self.result_queue.put, **monitor_options)
+        self.target_states = self.monitor.target_states
+        self.num_of_bars_in_chart = self.monitor.num_of_bars_in_chart
+        self.selected_target = self.ping_hosts[0]
+        self.show_debug_overlay = debug_overlay
+        # Where "now" comes from for the charts and labels; a replay passes its own simulated clock
+        self.clock = clock if clock is not None else time.time
+        self.probing = probing
+        self.start_time = datetime.datetime.now()
+
+        self.last_packet_loss_update = time.time()
+        self.results_arrived = False  # Since the last once-a-second update, for the heartbeat
+
+        # Add variables to track the last update time for the 1m and 5m charts, so we only update them when needed
+        self.last_update_time_1m = datetime.datetime.fromtimestamp(self.clock())
+        self.last_update_time_5m = datetime.datetime.fromtimestamp(self.clock())
+
+        # Initialize packet loss history for each time frame
+        self.packet_loss_history_1s = deque(maxlen=self.num_of_bars_in_chart)  # each bar represents 1 second
+        self.packet_loss_history_1m = deque(maxlen=self.num_of_bars_in_chart)  # each bar represents 1 minute
+        self.packet_loss_history_5m = deque(maxlen=self.num_of_bars_in_chart)  # each bar represents 5 minutes
+
+        # The charts are built once the window is on screen (see ensure_chart), they are the slow part
+        self.chart = None
+        self.initUI()
+
+        self.packet_loss_indicator.clicked.connect(self.toggle_interface)
+        self.packet_loss_indicator.packet_loss_graph.setVisible(False)  # Hide the overlay
+        self.interface_hidden = False  # Add a flag to track the state of the interface
+        self.select_target(self.selected_target)
+
+        # Start probing; the scheduler runs on its own thread, so nothing here blocks the GUI.
+        # A replay feeds recorded samples to update_metrics instead.
+        if probing:
+            self.monitor.start()
+
+        # Set up a timer for updating the charts
+        self.chart_and_label_update_timer = QTimer(self)
+        self.chart_and_label_update_timer.timeout.connect(self.updateChartLabelsAndRuntime)
+        self.chart_and_label_update_timer.start(1000)  # Update every 1000 milliseconds (1 second)
+
+    def select_target(self, host):
+        self.selected_target = host
+        self.setWindowTitle(f'ProPing - {host}' if len(self.ping_hosts) > 1 else 'ProPing')
+        if self.target_overview is not None:
+            self.target_overview.set_selected(host)
+
+        # Redraw every chart for the new host right away instead of waiting for the next 1m/5m refresh
+        self.last_update_time_1m = datetime.datetime.min
+        self.last_update_time_5m = datetime.datetime.min
+        self.packet_loss_indicator.set_packet_loss(self.calculate_packet_loss(1))
+        self.updateChartLabelsAndRuntime()
+
+    def toggle_interface(self):
+        if self.interface_hidden:
+            self.ensure_chart()
+            self.canvas.setVisible(True)
+            if self.target_overview is not None:
+                self.target_overview.setVisible(True)
+            self.packet_loss_1s_label.setVisible(True)
+            self.packet_loss_1m_label.setVisible(True)
+            self.packet_loss_5m_label.setVisible(True)
+            self.dns_label.setVisible(True)
+            self.incident_label.setVisible(True)
+            if self.path_view is not None:
+                self.path_view.setVisible(True)
+            self.packet_loss_indicator.packet_loss_graph.setVisible(False)  # Hide the overlay
+            self.chart_title_label.setVisible(True)
+            self.setMinimumSize(500, 650)  # Restore the minimum size
+            self.resize(500, 650)  # Restore the original size
+        else:
+            self.canvas.setVisible(False)
+            if self.target_overview is not None:
+                self.target_overview.setVisible(False)
+            self.packet_loss_1s_label.setVisible(False)
+            self.packet_loss_1m_label.setVisible(False)
+            self.packet_loss_5m_label.setVisible(False)
+            self.dns_label.setVisible(False)
+            self.incident_label.setVisible(False)
+            if self.path_view is not None:
+                self.path_view.setVisible(False)
+            self.packet_loss_indicator.packet_loss_graph.setVisible(True) # Show the overlay
+            self.chart_title_label.setVisible(False)
+            
+            # Calculate the size of the visible widgets
+            indicator_size = self.packet_loss_indicator.sizeHint()
+            heartbeat_size = self.heartbeat_indicator.sizeHint()
+            runtime_size = self.runtime_label.sizeHint()
+            
+            # Calculate the total height of the visible widgets with some padding
+            total_height = indicator_size.height() + heartbeat_size.height() + runtime_size.height() + 20
+            
+            # Calculate the maximum width of the visible widgets with some padding
+            max_width = max(indicator_size.width(), heartbeat_size.width(), runtime_size.width()) + 20
+            
+            # Set the minimum size of the main window to a smaller value
+            self.setMinimumSize(170, 170)
+            
+            # Resize the main window to fit the visible widgets
+            self.resize(max_width, total_height)
+        
+        self.interface_hidden = not self.interface_hidden  # Toggle the flag
+        if not self.interface_hidden:
+            self.updateChartLabelsAndRuntime()  # The labels and charts were left alone while collapsed
+
+    def closeEvent(self, event):
+        # Stop the probe scheduler and wait for its thread to finish
+        self.monitor.stop(timeout=1.5)
+
+        # Stop any running timers
+        self.chart_and_label_update_timer.stop()
+
+        # Ensure the application quits
+        QApplication.quit()
+
+        # Call the base class implementation
+        super().closeEvent(event)
+
+    def initUI(self):
+        # Set main window properties
+        self.setWindowTitle('ProPing')
+        self.setGeometry(300, 300, 500, 650)
+
+        chart_layout = QVBoxLayout()
+        chart_layout.setSpacing(0)
+        self.chart_layout = chart_layout  # Store a reference to the chart layout
+
+        # Create central widget and layout
+        central_widget = QWidget(self)
+        self.setCentralWidget(central_widget)
+
+        # Debug overlay with the monitor's own timings, floating over the top left corner (F12 toggles it)
+        self.debug_overlay = QLabel(central_widget)
+        self.debug_overlay.setStyleSheet(self.DEBUG_OVERLAY_STYLE.format(color='black'))
+        self.debug_overlay.move(4, 4)
+        self.debug_overlay.setVisible(self.show_debug_overlay)
+
+        # Create a vertical layout for the entire window
+        main_layout = QVBoxLayout(central_widget)
+
+        # Create a horizontal layout for the indicator and labels
+        top_layout = QHBoxLayout()
+
+        # Create and add the packet loss indicator widget
+        self.packet_loss_indicator = PacketLossIndicator()
+        top_layout.addWidget(self.packet_loss_indicator)
+
+        # Create a layout for labels
+        labels_layout = QVBoxLayout()
+
+        # Add widgets for packet loss
+        self.packet_loss_1s_label = QLabel('1-Second Packet Loss: 0%', self)
+        labels_layout.addWidget(self.packet_loss_1s_label)
+
+        self.packet_loss_1m_label = QLabel('1-Minute Packet Loss: 0%', self)
+        labels_layout.addWidget(self.packet_loss_1m_label)
+
+        self.packet_loss_5m_label = QLabel('5-Minute Packet Loss: 0%', self)
+        labels_layout.addWidget(self.packet_loss_5m_label)
+
+        # Add the labels layout to the horizontal layout
+        top_layout.addLayout(labels_layout)
+
+        # Add the top horizontal layout to the main vertical layout
+        main_layout.addLayout(top_layout, 1)
+
+        # With more than one host, add an overview grid with a tile per host
+        self.target_overview = None
+        if len(self.ping_hosts) > 1:
+            self.target_overview = TargetOverview(self.ping_hosts, parent=self)
+            self.target_overview.target_selected.connect(self.select_target)
+            main_layout.addWidget(self.target_overview)
+
+        # Create a new QVBoxLayout for the chart and its title
+        chart_layout = QVBoxLayout()
+        chart_layout.setSpacing(0)  # Remove spacing between items in this layout
+
+        # Add a title label for the charts
+        chart_title_label = QLabel('Percent Packet Loss', self)
+        self.chart_title_label = chart_title_label  # Store a reference to the chart title label
+        chart_title_label.setAlignment(Qt.AlignCenter)
+        font = QFont()
+        font.setPointSize(24)
+        font.setBold(True)
+        chart_title_label.setFont(font)
+        chart_title_label.setStyleSheet("background-color: white; padding-top: 15px;")
+
+        # Set size policy for the title label to be fixed
+        sizePolicy = QSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)
+        chart_title_label.setSizePolicy(sizePolicy)
+
+        chart_layout.addWidget(chart_title_label)
+
+        # Until the charts are built, an empty widget holds their place in the layout
+        self.canvas = QWidget(self)
+        self.canvas.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.canvas.setStyleSheet("background-color: white;")
+        chart_layout.addWidget(self.canvas)
+        self.chart_layout = chart_layout
+
+        main_layout.addLayout(chart_layout, 4)  # Greater stretch factor for the chart
+
+        # The selected host's latest loss bursts, outages and latency spikes
+        self.incident_label = QLabel('Incidents: none', self)
+        main_layout.addWidget(self.incident_label)
+
+        # In path mode, loss and latency at every router on the way to the selected host
+        self.path_view = None
+        if self.monitor.path:
+            self.path_view = PathView(self)
+            main_layout.addWidget(self.path_view)
+
+        self.heartbeat_indicator = HeartbeatIndicator(self)
+
+        self.runtime_label = QLabel("Runtime: 0 seconds", self)
+
+        # Add an uptime label at the bottom
+        runtime_layout = QHBoxLayout()
+        runtime_layout.addWidget(self.heartbeat_indicator)
+        runtime_layout.addWidget(self.runtime_label)
+        self.dns_label = QLabel(self)  # How the selected host's name resolves, kept apart from packet loss
+        runtime_layout.addWidget(self.dns_label, alignment=Qt.AlignRight)
+        main_layout.addLayout(runtime_layout)
+
+    def initChart(self):
+        # Initialize the three packet loss bar charts, in place of the placeholder
+        self.chart = PacketLossChart(self.num_of_bars_in_chart)
+        placeholder = self.canvas
+        self.figure, self.axes, self.canvas = self.chart.figure, self.chart.axes, self.chart.canvas
+        self.bar_plot_1s, self.bar_plot_1m, self.bar_plot_5m = self.chart.bar_plots
+        self.chart_layout.replaceWidget(placeholder, self.canvas)
+        self.canvas.setVisible(placeholder.isVisible())
+        placeholder.deleteLater()
+        for index, history in enumerate((self.packet_loss_history_1s, self.packet_loss_history_1m,
+                                         self.packet_loss_history_5m)):
+            self.chart.set_history(index, history)
+
+    def ensure_chart(self):
+        # Build the charts the first time they are needed: after the first frame, or on expanding the window
+        if self.chart is None:
+            self.initChart()
+            self.chart_ready_seconds = time.perf_counter() - self.launch_time
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.first_frame_seconds is None:
+            self.first_frame_seconds = time.perf_counter() - self.launch_time
+            if not self.interface_hidden:
+                QTimer.singleShot(0, self.ensure_chart)
+
+    def update_runtime(self):
+        # Calculate uptime
+        current_time = datetime.datetime.now()
+        runtime_duration = current_time - self.start_time
+        total_seconds = int(runtime_duration.total_seconds())
+
+        # Format runtime into a readable string
+        if total_seconds < 60:
+            runtime_text = f"Runtime: {total_seconds} seconds"
+        elif total_seconds < 3600:
+            minutes = total_seconds // 60
+            seconds = total_seconds % 60
+            runtime_text = f"Runtime: {minutes} minutes, {seconds} seconds"
+        elif total_seconds < 86400:
+            hours = total_seconds // 3600
+            minutes = (total_seconds % 3600) // 60
+            runtime_text = f"Runtime: {hours} hours, {minutes} minutes"
+        else:
+            days = total_seconds // 86400
+            hours = (total_seconds % 86400) // 3600
+            runtime_text = f"Runtime: {days} days, {hours} hours"
+
+        # Update the label
+        set_text(self.runtime_label, runtime_text)
+
+    def updateChartLabelsAndRuntime(self):
+        start = time.perf_counter()
+        # The metrics exporter and the resolver touch the same state from their own threads. Collapsed,
+        # only the indicator and the runtime show, so the labels and charts are left alone.
+        if not self.interface_hidden:
+            with self.monitor.lock:
+                self.update_labels()
+                self.updateChart()
+        self.update_runtime()
+        if self.results_arrived:
+            self.results_arrived = False
+            self.heartbeat_indicator.toggle_color()
+        self.update_debug_overlay()
+        self.monitor.instrumentation.render.add(time.perf_counter() - start)
+
+    def update_debug_overlay(self):
+        # Once a second: how the monitor itself kept up over the last second. Always taken, so each
+        # overlay refresh covers exactly one period.
+        snapshot = self.monitor.instrumentation.snapshot()
+        if not self.debug_overlay.isVisible():
+            return
+        reasons = falling_behind(snapshot)
+        text = format_instrumentation(snapshot, separator='\n')
+        if self.first_frame_seconds is not None:
+            startup = f'First frame {self.first_frame_seconds * 1000:.0f} ms after launch'
+            if self.chart_ready_seconds is not None:
+                startup += f', charts {self.chart_ready_seconds * 1000:.0f} ms'
+            text = startup + '\n' + text
+        if reasons:
+            text = 'Monitor fell behind, loss may not be the network:\n' + '\n'.join(reasons) + '\n' + text
+        self.debug_overlay.setStyleSheet(self.DEBUG_OVERLAY_STYLE.format(color='#a00000' if reasons else 'black'))
+        self.debug_overlay.setText(text)
+        self.debug_overlay.adjustSize()
+        self.debug_overlay.raise_()
+
+    def keyPressEvent(self, event):
+        # F12 toggles the debug overlay
+        if event.key() == Qt.Key_F12:
+            self.debug_overlay.setVisible(not self.debug_overlay.isVisible())
+        else:
+            super().keyPressEvent(event)
+
+    def updateChart(self):
+        if not self.interface_hidden:  # Only update the charts if the interface is not hidden
+            current_time = datetime.datetime.fromtimestamp(self.clock())
+
+            # Update the 1-second interval chart
+            self.update_history(self.packet_loss_history_1s, 1, self.num_of_bars_in_chart)
+            if self.chart is not None:
+                self.chart.set_history(0, self.packet_loss_history_1s)
+
+            # Update the 1-minute interval chart only if a minute has passed
+            if (current_time - self.last_update_time_1m).total_seconds() >= 60:
+                self.update_history(self.packet_loss_history_1m, 60, self.num_of_bars_in_chart)
+                if self.chart is not None:
+                    self.chart.set_history(1, self.packet_loss_history_1m)
+                self.last_update_time_1m = current_time
+
+            # Update the 5-minute interval chart only if five minutes have passed
+            if (current_time - self.last_update_time_5m).total_seconds() >= 300:
+                self.update_history(self.packet_loss_history_5m, 300, self.num_of_bars_in_chart)
+                if self.chart is not None:
+                    self.chart.set_history(2, self.packet_loss_history_5m)
+                self.last_update_time_5m = current_time
+
+    def wrapper_update_metrics(self):
+        # Called on the scheduler thread when results are waiting and the GUI has not been woken yet
+        QApplication.instance().postEvent(self, CustomEvent(None))
+
+    def drain_results(self):
+        self.last_drain = time.perf_counter()
+        result_tuples = self.result_queue.drain()
+        if result_tuples:
+            self.monitor.instrumentation.queue_depth.add(len(result_tuples))
+            self.monitor.instrumentation.delivery_delay.add(max(0.0, time.time() - result_tuples[0][1]))
+        self.update_metrics(result_tuples)
+
+    def update_metrics(self, result_tuples):
+        # Fold the samples into their hosts' samples, 1s/1m/5m buckets and sliding windows
+        start = time.perf_counter()
+        with self.monitor.lock:
+            states = self.monitor.ingest_batch(result_tuples)
+        self.monitor.instrumentation.ingest.add(time.perf_counter() - start)
+        if states:
+            self.results_arrived = True
+        if self.selected_target not in states:
+            return
+
+        # Update packet loss indicator color
+        latest_packet_loss = self.calculate_packet_loss(1)
+        current_time = time.time()
+        if current_time - self.last_packet_loss_update >= 0.5:  # Update every 500 ms
+            self.packet_loss_indicator.set_packet_loss(latest_packet_loss)
+            self.last_packet_loss_update = current_time
+
+
+    def update_history(self, history_deque, interval_seconds, num_intervals):
+        # Read the average packet loss of the last num_intervals complete intervals, newest first
+        new_history = self.target_states[self.selected_target].history(interval_seconds, num_intervals, self.clock())
+
+        history_deque.clear()
+        history_deque.extend(new_history)
+
+    def update_labels(self):
+        # Function to calculate average, min, and max from deque
+        def get_stats(deque_data):
+            valid_data = [x for x in deque_data if x is not None]
+            if valid_data:
+                avg = sum(valid_data) / len(valid_data)
+                max_val = max(valid_data)
+                return avg, max_val
+            else:
+                return 0.0, 0.0
+
+        # Function to describe latency quantiles and jitter over the same buckets as the chart bars
+        def get_latency_text(bucket_series):
+            end_bucket_id = bucket_series.bucket_id(self.clock())
+            (p50, p95, p99), jitter = bucket_series.latency_summary(end_bucket_id, self.num_of_bars_in_chart)
+            if p50 is None:
+                return 'Latency: no replies'
+            return (f'Latency p50 {p50 * 1000:.1f} / p95 {p95 * 1000:.1f} / p99 {p99 * 1000:.1f} ms, '
+                    f'Jitter {jitter * 1000:.1f} ms')
+
+        # Update labels using the data from the deques
+        state = self.target_states[self.selected_target]
+        avg_1s, max_1s = get_stats(self.packet_loss_history_1s)
+        set_text(self.packet_loss_1s_label,
+                 f'1-Second Packet Loss: Avg {avg_1s:.1f}% / Max {max_1s:.1f}%\n{get_latency_text(state.buckets_1s)}')
+
+        avg_1m, max_1m = get_stats(self.packet_loss_history_1m)
+        set_text(self.packet_loss_1m_label,
+                 f'1-Minute Packet Loss: Avg {avg_1m:.1f}% / Max {max_1m:.1f}%\n{get_latency_text(state.buckets_1m)}')
+
+        avg_5m, max_5m = get_stats(self.packet_loss_history_5m)
+        set_text(self.packet_loss_5m_label,
+                 f'5-Minute Packet Loss: Avg {avg_5m:.1f}% / Max {max_5m:.1f}%\n{get_latency_text(state.buckets_5m)}')
+        dns_text = format_dns(state) if self.probing else ''
+        if self.monitor.rate_controller is not None:
+            dns_text = f'{self.monitor.probe_rate(state.host):g} probes/s, {dns_text}'
+        set_text(self.dns_label, dns_text)
+
+        current_time = self.clock()
+        incidents = self.monitor.incident_log.for_host(self.selected_target, 3)
+        if incidents:
+            set_text(self.incident_label, 'Incidents:\n' + '\n'.join(format_incident(incident, current_time)
+                                                                   for incident in incidents))
+        else:
+            set_text(self.incident_label, 'Incidents: none')
+
+        if self.path_view is not None:
+            self.path_view.set_rows(self.path_rows(current_time))
+
+        # Recolour the overview tiles from each host's last 10 seconds
+        if self.target_overview is not None:
+            for host, tile in self.target_overview.tiles.items():
+                tile.set_packet_loss(self.target_states[host].calculate_packet_loss(10, current_time))
+
+
+    def path_rows(self, current_time):
+        # The selected host's hops, then the host itself
+        hops = self.monitor.paths.get(self.selected_target, [])
+        targets = [(hop.ttl, self.monitor.hop_addresses.get(hop), self.monitor.hop_states[hop]) for hop in hops]
+        state = self.target_states[self.selected_target]
+        targets.append((len(hops) + 1, state.address, state))
+        rows = []
+        for ttl, address, state in targets:
+            (p50, _, _), _ = state.buckets_1s.latency_summary(state.buckets_1s.bucket_id(current_time), 60)
+            rows.append((ttl, address, state.calculate_packet_loss(10, current_time),
+                         state.calculate_packet_loss(60, current_time), p50))
+        return rows
+
+    def calculate_packet_loss(self, seconds):
+        with self.monitor.lock:
+            return self.target_states[self.selected_target].calculate_packet_loss(seconds, self.clock())
+
+    def customEvent(self, event):
+        # Results are waiting. Drain them at most once a frame; until then more results just queue up
+        # without posting further events.
+        wait = self.last_drain + FRAME_INTERVAL - time.perf_counter()
+        if wait > 0:
+            QTimer.singleShot(int(wait * 1000) + 1, self.drain_results)
+        else:
+            self.drain_results()
+
+class CustomEvent(QEvent):
+    def __init__(self, data):
+        super().__init__(QEvent.User)
+        self.data = data
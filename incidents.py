@@ -0,0 +1,198 @@
+import datetime
+import json
+import os
+from collections import deque
+
+from aggregation import SlidingWindow
+
+# Loss incidents open when the loss over the last LOSS_WINDOW seconds reaches LOSS_OPEN percent and close
+# once it is back down to LOSS_CLOSE; the gap between the two keeps a flapping link from opening an
+# incident per sample. A loss incident becomes an outage when nothing at all has come back for
+# OUTAGE_SECONDS.
+LOSS_WINDOW = 5
+LOSS_OPEN = 20.0
+LOSS_CLOSE = 5.0
+LOSS_MIN_SAMPLES = 5
+OUTAGE_SECONDS = 3
+
+# Latency spikes open when the fast moving average of the round-trip time climbs to LATENCY_OPEN times the
+# slow baseline (and at least LATENCY_MIN_RISE seconds above it), and close when it falls under LATENCY_CLOSE
+# times the baseline. The baseline only learns while no spike is open.
+LATENCY_OPEN = 3.0
+LATENCY_CLOSE = 1.5
+LATENCY_MIN_RISE = 0.02
+LATENCY_WARMUP = 20
+
+INCIDENTS_FILE = 'incidents.jsonl'
+
+
+class Incident:
+    __slots__ = ('host', 'kind', 'start', 'end', 'samples', 'lost', 'worst_loss', 'worst_rtt')
+
+    def __init__(self, host, kind, start):
+        self.host = host
+        self.kind = kind  # 'loss', 'outage' or 'latency'
+        self.start = start
+        self.end = None  # None while the incident is still open
+        self.samples = 0
+        self.lost = 0
+        self.worst_loss = 0.0  # Worst windowed packet loss percentage seen
+        self.worst_rtt = None  # Slowest round-trip time seen, in seconds
+
+    def add(self, packet_loss, rtt, window_loss):
+        self.samples += 1
+        if packet_loss:
+            self.lost += 1
+        self.worst_loss = max(self.worst_loss, window_loss)
+        if rtt is not None and (self.worst_rtt is None or rtt > self.worst_rtt):
+            self.worst_rtt = rtt
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, record):
+        incident = cls(record['host'], record['kind'], record['start'])
+        for name in cls.__slots__:
+            setattr(incident, name, record.get(name))
+        return incident
+
+
+class IncidentLog:
+    # The most recent incidents of every host, oldest first, plus listeners told when one opens, escalates
+    # or closes. With a path, every incident is also appended to a JSON-lines file when it closes.
+    def __init__(self, max_incidents=1000, path=None):
+        self.incidents = deque(maxlen=max_incidents)
+        self.path = path
+        self.listeners = []  # Called with (event, incident), event being 'opened', 'escalated' or 'closed'
+
+    def _notify(self, event, incident):
+        for listener in self.listeners:
+            listener(event, incident)
+
+    def opened(self, incident):
+        self.incidents.append(incident)
+        self._notify('opened', incident)
+
+    def escalated(self, incident):
+        self._notify('escalated', incident)
+
+    def closed(self, incident):
+        self._write(incident)
+        self._notify('closed', incident)
+
+    def _write(self, incident):
+        if self.path is not None:
+            with open(self.path, 'a') as incidents_file:
+                incidents_file.write(json.dumps(incident.to_dict()) + '\n')
+
+    def close(self):
+        # Record the incidents still open as such, so the file shows what was going on at exit
+        for incident in self.incidents:
+            if incident.end is None:
+                self._write(incident)
+
+    def for_host(self, host, count=None):
+        # The host's incidents, newest first
+        incidents = [incident for incident in reversed(self.incidents) if incident.host == host]
+        return incidents if count is None else incidents[:count]
+
+
+class IncidentDetector:
+    # Opens and closes one host's incidents from its samples as they arrive. Each sample costs O(1): a
+    # sliding loss window, a run of consecutive losses and two moving averages of the round-trip time.
+    def __init__(self, host, incident_log):
+        self.host = host
+        self.incident_log = incident_log
+
+        self.loss_window = SlidingWindow(LOSS_WINDOW)
+        self.lost_since = None  # Timestamp of the first loss in the current run of losses
+        self.loss_incident = None
+
+        self.rtt_baseline = None
+        self.rtt_fast = None
+        self.replies = 0
+        self.latency_incident = None
+
+    def add(self, timestamp, packet_loss, rtt, weight=1.0):
+        self.loss_window.add(timestamp, packet_loss, weight)
+        window_loss = self.loss_window.packet_loss(timestamp)
+        if packet_loss:
+            if self.lost_since is None:
+                self.lost_since = timestamp
+        else:
+            self.lost_since = None
+        outage = self.lost_since is not None and timestamp - self.lost_since >= OUTAGE_SECONDS
+
+        incident = self.loss_incident
+        if incident is None:
+            if outage or (window_loss >= LOSS_OPEN and len(self.loss_window.samples) >= LOSS_MIN_SAMPLES):
+                # It began with the losses that got it opened: the current run of losses if there is
+                # one, and the samples in the window so far
+                start = self.lost_since if self.lost_since is not None else timestamp
+                incident = self.loss_incident = Incident(self.host, 'outage' if outage else 'loss', start)
+                incident.add(packet_loss, rtt, window_loss)
+                incident.samples = len(self.loss_window.samples)
+                incident.lost = sum(1 for _, loss, _ in self.loss_window.samples if loss)
+                self.incident_log.opened(incident)
+        else:
+            incident.add(packet_loss, rtt, window_loss)
+            if outage and incident.kind == 'loss':
+                incident.kind = 'outage'
+                self.incident_log.escalated(incident)
+            elif not outage and window_loss <= LOSS_CLOSE:
+                incident.end = timestamp
+                self.loss_incident = None
+                self.incident_log.closed(incident)
+
+        if self.latency_incident is not None:
+            self.latency_incident.add(packet_loss, rtt, window_loss)
+        if rtt is not None:
+            self._add_rtt(timestamp, packet_loss, rtt, window_loss)
+
+    def _add_rtt(self, timestamp, packet_loss, rtt, window_loss):
+        self.replies += 1
+        if self.rtt_baseline is None:
+            self.rtt_baseline = self.rtt_fast = rtt
+            return
+        self.rtt_fast += (rtt - self.rtt_fast) / 4
+        baseline = self.rtt_baseline
+
+        incident = self.latency_incident
+        if incident is None:
+            if (self.replies >= LATENCY_WARMUP and self.rtt_fast >= baseline * LATENCY_OPEN
+                    and self.rtt_fast - baseline >= LATENCY_MIN_RISE):
+                incident = self.latency_incident = Incident(self.host, 'latency', timestamp)
+                incident.add(packet_loss, rtt, window_loss)
+                self.incident_log.opened(incident)
+            else:
+                self.rtt_baseline += (rtt - baseline) / 64
+        elif self.rtt_fast <= baseline * LATENCY_CLOSE:
+            incident.end = timestamp
+            self.latency_incident = None
+            self.incident_log.closed(incident)
+
+
+def read_incidents(data_dir):
+    # The incidents recorded under data_dir, oldest first
+    path = os.path.join(data_dir, INCIDENTS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as incidents_file:
+        return [Incident.from_dict(json.loads(line)) for line in incidents_file if line.strip()]
+
+
+def format_incident(incident, current_time=None):
+    # current_time is None for incidents read back from disk, where an open one was open when we stopped
+    start = datetime.datetime.fromtimestamp(incident.start).strftime('%Y-%m-%d %H:%M:%S')
+    text = f'{incident.host}: {incident.kind} from {start}'
+    if incident.end is not None:
+        text += f', {incident.end - incident.start:.0f} s'
+    elif current_time is not None:
+        text += f', {current_time - incident.start:.0f} s so far'
+    else:
+        text += ', still open when proPing stopped'
+    text += f', worst loss {incident.worst_loss:.0f}%, {incident.lost}/{incident.samples} lost'
+    if incident.kind == 'latency' and incident.worst_rtt is not None:
+        text += f', worst rtt {incident.worst_rtt * 1000:.1f} ms'
+    return text
@@ -0,0 +1,95 @@
+# proPing's measurements of itself, so that when the charts show loss we can tell whether the network
+# dropped packets or the monitor fell behind (a late send, a stalled loop, a busy GUI thread).
+# Everything is a running count/sum/max since the last snapshot, O(1) to record and without locks: a
+# snapshot swaps in fresh stats, and at worst a value recorded at that very moment is lost.
+
+# Above these, a period is flagged as one where the monitor, not the network, may explain odd numbers
+SEND_SKEW_WARNING = 0.05  # Seconds a probe went out after its slot
+DELIVERY_WARNING = 1.0  # Seconds a result waited before it was ingested
+
+
+class Stat:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class Instrumentation:
+    STATS = ('send_skew', 'ingest', 'render', 'queue_depth', 'delivery_delay')
+    COUNTERS = ('sent', 'skipped', 'late_replies', 'send_errors', 'subprocess_timeouts')
+
+    def __init__(self):
+        for name in self.STATS:
+            setattr(self, name, Stat())
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+
+    def merge(self, snapshot):
+        # Add another Instrumentation's snapshot, e.g. one shipped from a worker process
+        for name in self.STATS:
+            getattr(self, name).merge(snapshot[name])
+        for name in self.COUNTERS:
+            self.counts[name] += snapshot[name]
+
+    def snapshot(self):
+        # The stats and counters since the last snapshot, as a dict; starts a new period
+        snapshot = {}
+        for name in self.STATS:
+            snapshot[name] = getattr(self, name)
+            setattr(self, name, Stat())
+        counts, self.counts = self.counts, dict.fromkeys(self.COUNTERS, 0)
+        snapshot.update(counts)
+        return snapshot
+
+
+def falling_behind(snapshot):
+    # Why the monitor itself may have distorted this period's numbers, or an empty list
+    reasons = []
+    if snapshot['skipped']:
+        reasons.append(f'{snapshot["skipped"]} probe(s) skipped')
+    if snapshot['send_skew'].max > SEND_SKEW_WARNING:
+        reasons.append(f'a probe went out {snapshot["send_skew"].max * 1000:.0f} ms late')
+    if snapshot['delivery_delay'].max > DELIVERY_WARNING:
+        reasons.append(f'results waited up to {snapshot["delivery_delay"].max:.1f} s to be ingested')
+    if snapshot['subprocess_timeouts']:
+        reasons.append(f'{snapshot["subprocess_timeouts"]} ping process(es) killed')
+    return reasons
+
+
+def format_instrumentation(snapshot, separator=', '):
+    def ms(stat):
+        return f'{stat.mean * 1000:.2f}/{stat.max * 1000:.2f} ms' if stat.count else '-'
+
+    lines = [
+        f'sent {snapshot["sent"]}, skipped {snapshot["skipped"]}, send errors {snapshot["send_errors"]}, '
+        f'late replies {snapshot["late_replies"]}',
+        f'send skew mean/max {ms(snapshot["send_skew"])}',
+        f'ingest {ms(snapshot["ingest"])} x{snapshot["ingest"].count}, '
+        f'delivery delay max {snapshot["delivery_delay"].max * 1000:.0f} ms',
+    ]
+    if snapshot['queue_depth'].count:
+        lines.append(f'queue depth mean/max {snapshot["queue_depth"].mean:.1f}/{snapshot["queue_depth"].max:.0f}')
+    if snapshot['render'].count:
+        lines.append(f'render {ms(snapshot["render"])}')
+    return separator.join(lines)
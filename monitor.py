@@ -0,0 +1,518 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from collections import deque
+
+from adaptive import BURST_RATE, RateController
+from aggregation import BucketSeries, JitterEstimator, RttHistogram, SlidingWindow, summarize_latency
+from exporter import MetricsExporter
+from instrumentation import Instrumentation, falling_behind, format_instrumentation
+from incidents import Incident, IncidentDetector, IncidentLog, INCIDENTS_FILE, format_incident
+from path import Hop, discover_paths
+from probes import IcmpProbe, make_probe
+from resolver import Resolver, DNS_REFRESH_SECONDS
+from samplestore import SampleStore, STATUS_REPLY, sample_status
+from scheduler import ProbeScheduler
+from sharding import ShardReport, ShardedProbing
+from storage import SampleLog, RAW_RETENTION_DAYS, sample_weights
+from stream import ResultStream
+
+NUM_OF_BARS_IN_CHART = 60
+SECONDS_IN_MINUTE = 60
+MAX_MINUTE_INTERVAL = 5
+
+log = logging.getLogger('proping')
+
+
+class TargetState:
+    # Everything kept about one monitored host: the raw samples, the 1s/1m/5m buckets behind the charts
+    # and labels, and sliding windows for recent packet loss. Every sample is folded in once, on arrival.
+    def __init__(self, host, history_samples, num_of_bars_in_chart=NUM_OF_BARS_IN_CHART, incident_log=None):
+        self.host = host
+        self.ping_results = SampleStore(history_samples)
+
+        # Running packet loss and latency per bucket for each time frame.
+        # One spare bucket holds the interval still in progress.
+        self.jitter_estimator = JitterEstimator()
+        self.buckets_1s = BucketSeries(1, num_of_bars_in_chart + 1)
+        self.buckets_1m = BucketSeries(60, num_of_bars_in_chart + 1)
+        self.buckets_5m = BucketSeries(300, num_of_bars_in_chart + 1)
+        self.buckets_by_interval = {1: self.buckets_1s, 60: self.buckets_1m, 300: self.buckets_5m}
+
+        # Packet loss over the most recent seconds, keyed by window length. Other lengths are read from ping_results.
+        self.packet_loss_windows = {seconds: SlidingWindow(seconds) for seconds in (1, 10, 60)}
+
+        # Totals since start for the metrics exporter: probes by status and the round-trip time histogram
+        self.probe_counts = [0, 0, 0]  # Indexed by STATUS_REPLY, STATUS_LOST, STATUS_ERROR
+        self.rtt_histogram = RttHistogram()
+
+        # Loss bursts, outages and latency spikes, detected as the samples arrive
+        self.incident_detector = IncidentDetector(host, incident_log) if incident_log is not None else None
+
+        self.log = None  # storage.TargetLog when history is persisted
+
+        # The cached address probes go to, and how its last lookup went. A failing lookup keeps the old
+        # address, so a DNS outage shows here rather than as packet loss.
+        self.address = None
+        self.dns_time = None  # Seconds the last successful lookup took
+        self.dns_error = None  # Message of the last lookup if it failed
+        self.dns_failures = 0
+
+    def attach_log(self, target_log, current_time=None):
+        # Persist samples to target_log from now on, and first restore the charts' buckets and the raw
+        # samples still in range from it, so a restart picks up where the last run left off
+        if current_time is None:
+            current_time = time.time()
+        self.log = target_log
+        for interval_seconds, bucket_series in self.buckets_by_interval.items():
+            end_bucket_id = bucket_series.bucket_id(current_time) + 1  # Include the bucket in progress
+            bucket_ids, loss_sums, counts, rtt_sums, rtt_counts = target_log.read_rollup(
+                interval_seconds, end_bucket_id, bucket_series.num_buckets)
+            bucket_series.load(bucket_ids, loss_sums, counts)
+
+        # Oldest first; the store keeps only the newest samples that fit
+        for samples in target_log.read_samples():
+            self.ping_results.extend(samples['timestamp'], samples['status'], samples['rtt'], sample_weights(samples))
+
+    def add_sample(self, timestamp, result, rtt, weight=1.0):
+        # Anything but a reply ('100', 'Error', 'N/A') counts as a lost packet. weight is how much probing
+        # time the sample stands for (see ProbeScheduler), used to average packet loss.
+        status = sample_status(result)
+        packet_loss_value = 0.0 if status == STATUS_REPLY else 100.0
+
+        self.ping_results.append(timestamp, status, rtt, weight)
+        self.probe_counts[status] += 1
+
+        jitter = 0.0
+        if rtt is not None:
+            jitter = self.jitter_estimator.add(rtt)
+            self.rtt_histogram.add(rtt)
+        for bucket_series in self.buckets_by_interval.values():
+            bucket_series.add(timestamp, packet_loss_value, rtt, jitter, weight)
+        for window in self.packet_loss_windows.values():
+            window.add(timestamp, packet_loss_value, weight)
+        if self.incident_detector is not None:
+            self.incident_detector.add(timestamp, packet_loss_value, rtt, weight)
+        if self.log is not None:
+            self.log.append(timestamp, status, packet_loss_value, rtt, weight)
+        return packet_loss_value
+
+    def add_summary(self, summary):
+        # Fold in one second of samples pre-aggregated by a worker process (see sharding.py). The worker
+        # keeps the raw samples, incidents and sample log, so only the aggregates are updated here.
+        (host, second, counts, loss_sum, weight, latency_counts, histogram_counts, rtt_sum,
+         jitter_sum, jitter_count, jitter) = summary
+        for status, count in enumerate(counts):
+            self.probe_counts[status] += count
+        self.rtt_histogram.merge_counts(histogram_counts, rtt_sum)
+        if jitter is not None:  # None when the worker is gone and nothing was measured
+            self.jitter_estimator.jitter = jitter
+        for bucket_series in self.buckets_by_interval.values():
+            bucket_series.add_summary(second, loss_sum, sum(counts), weight, latency_counts, jitter_sum, jitter_count)
+        if weight:
+            for window in self.packet_loss_windows.values():
+                window.add(second + 1, loss_sum / weight, weight)
+
+    def calculate_packet_loss(self, seconds, current_time=None):
+        if current_time is None:
+            current_time = time.time()
+        window = self.packet_loss_windows.get(seconds)
+        if window is not None:
+            return window.packet_loss(current_time)
+        # Any other length is summed from the tail of ping_results, with NumPy, a run of the ring buffer at a time
+        loss_sum, weight_sum = self.ping_results.packet_loss(current_time - seconds)
+        return round(loss_sum / weight_sum, 2) if weight_sum else 0.0
+
+    def history(self, interval_seconds, num_intervals, current_time=None):
+        # Average packet loss of the last num_intervals complete intervals, newest first
+        bucket_series = self.buckets_by_interval[interval_seconds]
+        end_bucket_id = bucket_series.bucket_id(time.time() if current_time is None else current_time)
+        return bucket_series.history(end_bucket_id, num_intervals)
+
+
+class Monitor:
+    # The monitoring core: probes every host from one scheduler thread and folds the results into a
+    # TargetState per host. It knows nothing about Qt; a front end passes on_result to choose which thread
+    # the results are ingested on (the GUI posts them to its event loop, headless mode ingests them directly).
+    def __init__(self, ping_hosts, probe_backend='auto', ping_frequency=10, history_minutes=None, on_result=None,
+                 data_dir=None, retention_days=RAW_RETENTION_DAYS, family=socket.AF_INET,
+                 dns_refresh=DNS_REFRESH_SECONDS, metrics_port=None, metrics_address='127.0.0.1', probe_port=None,
+                 adaptive=False, burst_rate=BURST_RATE, rate_budget=None, workers=1, path=False,
+                 stream_path=None, stream_port=None, stream_address='127.0.0.1', addresses=None):
+        self.ping_hosts = list(ping_hosts)
+        self.probe_backend = probe_backend
+        self.ping_frequency = ping_frequency
+        self.family = family
+        self.probe_port = probe_port  # For the tcp and udp probes; None for their default port
+        self.workers = workers  # Worker processes the hosts are split across; 1 probes in this process
+        self.num_of_bars_in_chart = NUM_OF_BARS_IN_CHART
+
+        # Raw samples are kept for the last 300 minutes when watching one host. With several hosts the charts
+        # only need the 1s/1m/5m buckets, so keep 10 minutes of raw samples each to stay small.
+        if history_minutes is None:
+            history_minutes = NUM_OF_BARS_IN_CHART * MAX_MINUTE_INTERVAL if len(self.ping_hosts) == 1 else 10
+        if workers > 1:
+            # The workers only send per-second summaries, so the raw samples here are just the ones restored
+            # from the data directory, for loss over other window lengths. proPing rejects --history with --workers.
+            history_minutes = 1
+        history_samples = int(max(ping_frequency, burst_rate if adaptive else 0) * history_minutes * SECONDS_IN_MINUTE)
+        self.incident_log = IncidentLog(path=os.path.join(data_dir, INCIDENTS_FILE) if data_dir is not None else None)
+        self.target_states = {host: TargetState(host, history_samples, self.num_of_bars_in_chart, self.incident_log)
+                              for host in self.ping_hosts}
+
+        # In path mode every router on the way to each host is probed too (see path.py). The routers are
+        # found when probing starts; their states keep the same buckets, but no incidents, log or long history.
+        self.path = path
+        self.paths = {}  # host -> its Hops, nearest first
+        self.hop_states = {}  # Hop -> TargetState
+        self.hop_addresses = {}  # Hop -> the router last heard from at that TTL
+        self.hop_history_samples = int(ping_frequency * SECONDS_IN_MINUTE)
+        self.states = dict(self.target_states)  # Every probed target -> its state, hops included
+
+        # Optionally keep every sample on disk, restoring what earlier runs recorded
+        self.sample_log = None
+        if data_dir is not None:
+            self.sample_log = SampleLog(data_dir, retention_days)
+            current_time = time.time()
+            for host, state in self.target_states.items():
+                state.attach_log(self.sample_log.target_log(host), current_time)
+            if workers > 1:
+                # The workers write the log from now on; this process only restored from it
+                for state in self.target_states.values():
+                    state.log = None
+                self.sample_log.close()
+                self.sample_log = None
+
+        # Optionally serve the aggregates to Prometheus; binding the port here makes a port in use fail early
+        self.exporter = None
+        if metrics_port is not None:
+            self.exporter = MetricsExporter(self, metrics_port, metrics_address)
+
+        # Optionally stream every result and per-second aggregate to a file and/or server-sent event clients
+        self.stream = None
+        if stream_path is not None or stream_port is not None:
+            self.stream = ResultStream(self, stream_path, stream_port, stream_address)
+
+        self.resolver = Resolver(self.ping_hosts, family, dns_refresh, on_resolved=self._on_resolved)
+        self.probe = None
+        self.probe_scheduler = None
+        # In adaptive mode ping_frequency is the base rate, and each host bursts up to burst_rate on trouble
+        self.rate_controller = None
+        if adaptive:
+            self.rate_controller = RateController(self.ping_hosts, ping_frequency, burst_rate, rate_budget)
+        self.instrumentation = Instrumentation()
+        self.lock = threading.Lock()  # Held while ingesting on the scheduler thread, and by readers on other threads
+        self.on_result = on_result if on_result is not None else self._ingest_locked
+
+        # host -> (address, seconds the lookup took) when the caller has resolved the hosts already, so
+        # starting doesn't look them all up a second time
+        addresses = addresses if addresses is not None else {}
+        for host, (address, seconds) in addresses.items():
+            self.resolver.seed(host, address, seconds)
+
+        # Everything a worker process needs to probe its share of the hosts the way this process would
+        self.worker_options = {
+            'probe_backend': probe_backend, 'ping_frequency': ping_frequency, 'family': family,
+            'probe_port': probe_port, 'dns_refresh': dns_refresh, 'data_dir': data_dir,
+            'retention_days': retention_days, 'adaptive': adaptive, 'burst_rate': burst_rate,
+            'rate_budget': rate_budget,  # ShardedProbing splits it between the workers
+            'addresses': addresses,
+        }
+        self.shard_incidents = {}  # (host, start, latency?) -> this process's copy of a worker's open incident
+
+    def start(self):
+        if self.exporter is not None:
+            self.exporter.start()
+        if self.stream is not None:
+            self.stream.start()
+        if self.workers > 1:
+            # Each worker process probes and resolves its share of the hosts. Fail here rather than in every
+            # worker if the probe can't be opened.
+            make_probe(self.probe_backend, self.family, self.probe_port).close()
+            self.probe_scheduler = ShardedProbing(self.ping_hosts, self.workers, self.worker_options, self.on_result)
+            self.probe_scheduler.start()
+            return
+
+        # A single scheduler thread sends every probe to every host over one socket and collects the replies,
+        # while the resolver thread keeps their addresses fresh
+        if not self.resolver.addresses:
+            self.resolver.resolve_all()
+        self.resolver.start()
+        self.probe = make_probe(self.probe_backend, self.family, self.probe_port)
+        if self.path and not isinstance(self.probe, IcmpProbe):
+            raise OSError('Path mode needs an ICMP socket, and this machine does not give us one')
+        self.probe_scheduler = ProbeScheduler(self.ping_hosts, self.ping_frequency, self.probe, self.on_result,
+                                              self.resolver, self.instrumentation, self.rate_controller,
+                                              self.hop_addresses)
+        self.probe_scheduler.start()
+        if self.path:
+            # Finding the routers takes a second or two, so the hosts are probed meanwhile and the hops join
+            # once they are known. start() may be running on the GUI thread.
+            threading.Thread(target=self.discover_paths, name='PathDiscovery', daemon=True).start()
+
+    def discover_paths(self):
+        # Find the routers on the way to every host with TTL-limited probes, give each one a state, and have
+        # the scheduler probe them too. Discovery has an ICMP socket of its own: the scheduler is reading
+        # its socket, and the two sockets' replies never mix (the kernel keeps datagram ICMP sockets apart,
+        # and raw ones each have their own identifier).
+        log.info('Discovering the path to %d host(s)', len(self.ping_hosts))
+        addresses = {host: self.resolver.address(host) for host in self.ping_hosts}
+        try:
+            probe = IcmpProbe(self.family)
+            try:
+                paths = discover_paths(probe, addresses)
+            finally:
+                probe.close()
+        except OSError as e:
+            log.error('Could not discover the paths: %s', e)
+            return
+
+        targets = []
+        with self.lock:
+            for host, hop_addresses in paths.items():
+                if hop_addresses and hop_addresses[-1] == addresses[host]:
+                    hop_addresses = hop_addresses[:-1]  # The host itself, probed as usual
+                hops = [Hop(host, ttl) for ttl in range(1, len(hop_addresses) + 1)]
+                for hop, address in zip(hops, hop_addresses):
+                    self.hop_states[hop] = self.states[hop] = TargetState(
+                        f'{host} hop {hop.ttl}', self.hop_history_samples, self.num_of_bars_in_chart)
+                    if address is not None:
+                        self.hop_addresses[hop] = address
+                self.paths[host] = hops
+                targets += hops
+        for host, hops in self.paths.items():
+            log.info('Path to %s: %s', host, ', '.join(f'{hop.ttl} {self.hop_addresses.get(hop, "?")}'
+                                                        for hop in hops) or 'direct')
+        probe_scheduler = self.probe_scheduler
+        if probe_scheduler is not None:
+            probe_scheduler.add_targets(targets)
+
+    def stop(self, timeout=1.5):
+        if self.probe_scheduler is not None:
+            self.probe_scheduler.stop(timeout=timeout)
+            if self.probe is not None:
+                self.probe.close()
+            self.probe_scheduler = None
+        self.resolver.stop()
+        if self.exporter is not None:
+            self.exporter.stop()
+        if self.stream is not None:
+            self.stream.stop(timeout=timeout)
+        with self.lock:
+            self.incident_log.close()
+            if self.sample_log is not None:
+                self.sample_log.close()
+
+    def probe_rate(self, target):
+        # Probes per second currently sent to target
+        if self.rate_controller is not None:
+            return self.rate_controller.rates[target]
+        return self.ping_frequency
+
+    def ingest(self, result_tuple):
+        # Fold one (target, timestamp, result, rtt, weight) probe result, or a worker's ShardReport, into its
+        # host's state, at the time it was reported like ingest_batch, however long it waited to be ingested
+        if type(result_tuple) is ShardReport:
+            return self.ingest_report(result_tuple)
+        target, timestamp, result, rtt, weight = result_tuple
+        state = self.states[target]
+        state.add_sample(timestamp, result, rtt, weight)
+        if self.stream is not None:
+            self.stream.put(result_tuple)
+        return state
+
+    def ingest_batch(self, result_tuples):
+        # Fold a batch of probe results in, each at the time it was reported; returns the states that changed
+        states = {}
+        if self.stream is not None:
+            self.stream.extend(result_tuples)
+        for result_tuple in result_tuples:
+            if type(result_tuple) is ShardReport:
+                states.update(self.ingest_report(result_tuple))
+                continue
+            target, timestamp, result, rtt, weight = result_tuple
+            state = self.states[target]
+            state.add_sample(timestamp, result, rtt, weight)
+            states[target] = state
+        return states
+
+    def ingest_report(self, report):
+        # Fold in what a worker process sent (see sharding.py); returns the states that changed
+        states = {}
+        for summary in report.summaries:
+            state = self.target_states[summary[0]]
+            state.add_summary(summary)
+            states[state.host] = state
+        for event, record in report.incidents:
+            self._mirror_incident(event, record)
+        for lookup in report.resolved:
+            self._record_resolved(*lookup)
+        self.instrumentation.merge(report.instrumentation)
+        if report.rates is not None:
+            self.rate_controller.rates.update(report.rates)
+        return states
+
+    def _mirror_incident(self, event, record):
+        # Keep a copy of a worker's incident in incident_log, so listeners, the GUI and the incidents file
+        # see it as if it had been detected here
+        key = (record['host'], record['start'], record['kind'] == 'latency')
+        incident = self.shard_incidents.get(key)
+        if incident is None:
+            if event not in ('opened', 'updated'):
+                return
+            incident = self.shard_incidents[key] = Incident.from_dict(record)
+            self.incident_log.opened(incident)
+            return
+        for name in Incident.__slots__:
+            setattr(incident, name, record[name])
+        if event == 'escalated':
+            self.incident_log.escalated(incident)
+        elif event == 'closed':
+            del self.shard_incidents[key]
+            self.incident_log.closed(incident)
+
+    def _on_resolved(self, target, address, seconds, error):
+        # Called on the resolver thread after every lookup
+        with self.lock:
+            self._record_resolved(target, address, seconds, error)
+
+    def _record_resolved(self, target, address, seconds, error):
+        state = self.target_states[target]
+        state.address = address
+        if error is None:
+            if state.dns_error is not None:
+                log.warning('%s resolves again, to %s', target, address)
+            state.dns_time = seconds
+            state.dns_error = None
+        else:
+            if state.dns_error is None:
+                log.warning('Could not resolve %s (%s), still probing %s', target, error, address)
+            state.dns_error = error
+            state.dns_failures += 1
+
+    def _ingest_locked(self, result_tuple):
+        start = time.perf_counter()
+        with self.lock:
+            self.ingest(result_tuple)
+        self.instrumentation.ingest.add(time.perf_counter() - start)
+        self.instrumentation.delivery_delay.add(max(0.0, time.time() - result_tuple[1]))
+
+
+class ResultQueue:
+    # Hands probe results from the scheduler thread to a consumer thread in batches. deque.append and
+    # popleft are atomic, so the producer never takes a lock. on_wakeup is called only when the consumer
+    # has nothing pending, so however many results arrive before the next drain, it is woken once.
+    def __init__(self, on_wakeup):
+        self.results = deque()
+        self.on_wakeup = on_wakeup
+        self.wakeup_pending = False
+
+    def __len__(self):
+        return len(self.results)
+
+    def put(self, result_tuple):
+        # Called on the producer thread
+        self.results.append(result_tuple)
+        if not self.wakeup_pending:
+            self.wakeup_pending = True
+            self.on_wakeup()
+
+    def drain(self):
+        # Called on the consumer thread: everything queued so far, oldest first. The flag is cleared
+        # before popping, so a result put while draining is either popped now or brings a fresh wakeup.
+        self.wakeup_pending = False
+        return [self.results.popleft() for _ in range(len(self.results))]
+
+
+def snapshot_summary(state, current_time):
+    # Copy the numbers of one summary line. Like the metrics exporter's snapshots this is cheap enough to do
+    # under the monitor lock; the latency quantiles are worked out from the copy after it is released.
+    buckets = state.buckets_1s
+    return (state.calculate_packet_loss(10, current_time), state.calculate_packet_loss(60, current_time),
+            buckets.latency_counts(buckets.bucket_id(current_time), 60))
+
+
+def format_target_summary(host, summary, dns, probe_rate=None):
+    # One log line about a host: recent packet loss and the latency of the last minute, and the probe rate
+    # when it is adaptive
+    rate = f', {probe_rate:g} probes/s' if probe_rate is not None else ''
+    return f'{host}: {format_loss_and_latency(summary)}{rate}, {dns}'
+
+
+def format_hop_summary(hop, summary, address):
+    # One log line about a router on the way to a host in path mode
+    return f'  hop {hop.ttl} {address or "?"}: {format_loss_and_latency(summary)}'
+
+
+def format_loss_and_latency(summary):
+    loss_10s, loss_60s, latency_counts = summary
+    (p50, p95, p99), jitter = summarize_latency(latency_counts)
+    if p50 is None:
+        latency = 'no replies'
+    else:
+        latency = (f'p50 {p50 * 1000:.1f} ms p95 {p95 * 1000:.1f} ms p99 {p99 * 1000:.1f} ms '
+                   f'jitter {jitter * 1000:.1f} ms')
+    return f'loss 10s {loss_10s:.1f}% 60s {loss_60s:.1f}%, {latency}'
+
+
+def format_dns(state):
+    if state.dns_error is not None:
+        return f'DNS failing ({state.dns_failures} lookups failed), probing {state.address}'
+    if state.dns_time is None:
+        return 'DNS pending'
+    return f'DNS {state.dns_time * 1000:.1f} ms ({state.address})'
+
+
+def run_headless(monitor, log_interval=10):
+    # Log a summary line per host of a started monitor every log_interval seconds until interrupted, then
+    # stop it
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop_event.set())
+
+    def log_incident(event, incident):
+        log.warning('Incident %s: %s', event, format_incident(incident, time.time()))
+    monitor.incident_log.listeners.append(log_incident)
+
+    log.info('Monitoring %d host(s) at %g probes/s each', len(monitor.ping_hosts), monitor.ping_frequency)
+    try:
+        while not stop_event.wait(log_interval):
+            current_time = time.time()
+            for host, state in monitor.target_states.items():
+                # The lock is taken per host and only to copy the numbers, so the scheduler thread can go on
+                # ingesting in between; formatting them happens after
+                with monitor.lock:
+                    summary = snapshot_summary(state, current_time)
+                    dns = format_dns(state)
+                    probe_rate = monitor.probe_rate(host) if monitor.rate_controller is not None else None
+                    hops = [(hop, snapshot_summary(monitor.hop_states[hop], current_time),
+                             monitor.hop_addresses.get(hop)) for hop in monitor.paths.get(host, ())]
+                log.info(format_target_summary(host, summary, dns, probe_rate))
+                for hop, hop_summary, address in hops:
+                    log.info(format_hop_summary(hop, hop_summary, address))
+
+            # How the monitor itself kept up, flagged when it may explain loss the network did not cause
+            snapshot = monitor.instrumentation.snapshot()
+            reasons = falling_behind(snapshot)
+            if reasons:
+                log.warning('Monitor fell behind (%s), loss in this period may not be the network: %s',
+                            '; '.join(reasons), format_instrumentation(snapshot))
+            else:
+                log.info('Monitor: %s', format_instrumentation(snapshot))
+    finally:
+        monitor.stop()
+        log.info('Stopped')
+
+
+def read_targets_file(path):
+    # One hostname or IP address per line; blank lines and '#' comments are ignored
+    targets = []
+    with open(path) as targets_file:
+        for line in targets_file:
+            target = line.split('#', 1)[0].strip()
+            if target:
+                targets.append(target)
+    return targets
@@ -0,0 +1,68 @@
+import select
+import time
+from collections import namedtuple
+
+# Path mode watches every router on the way to a host, like mtr. Each router is probed the way traceroute
+# finds it: an echo request to the host itself whose TTL runs out at that router, which then sends back a
+# time exceeded error. The scheduler treats each hop as one more target on its grid, sharing the probe
+# socket, so a 30-hop path costs 30 more timers rather than 30 more threads.
+MAX_HOPS = 30
+DISCOVERY_ROUNDS = 2  # Routers rate limit their errors, so a silent TTL gets a second chance
+
+# One router on the way to host: probes sent to host with this TTL expire there
+Hop = namedtuple('Hop', 'host ttl')
+
+
+def discover_paths(probe, addresses, max_hops=MAX_HOPS, rounds=DISCOVERY_ROUNDS):
+    # Find the routers on the way to each host -> address in addresses, sending a probe with every TTL up to
+    # max_hops to every host at once over the ICMP probe's socket. Returns host -> the address that answered
+    # at each TTL (None where nothing did), ending with the host's own address at the TTL that first reaches
+    # it. Trailing TTLs nobody answered are left out.
+    answers = {host: [None] * max_hops for host in addresses}
+    reached = {host: max_hops + 1 for host in addresses}  # Lowest TTL the host itself answered at
+
+    for _ in range(rounds):
+        waiting = {}  # sequence -> (host, ttl)
+        for host, address in addresses.items():
+            if address is None:
+                continue
+            for ttl in range(1, min(max_hops, reached[host] - 1) + 1):
+                if answers[host][ttl - 1] is not None:
+                    continue
+                sequence = probe.next_sequence()
+                try:
+                    probe.send(address, sequence, ttl)
+                except OSError:
+                    continue
+                waiting[sequence] = (host, ttl)
+
+        deadline = time.perf_counter() + probe.timeout
+        while waiting:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([probe.sock], [], [], remaining)
+            if not readable:
+                continue
+            for sender, sequence, recv_time in probe.receive():
+                if sequence not in waiting:
+                    continue
+                host, ttl = waiting.pop(sequence)
+                answers[host][ttl - 1] = sender
+                if sender == addresses[host]:
+                    reached[host] = min(reached[host], ttl)
+            # Done once every TTL short of the host has answered
+            if all(ttl >= reached[host] for host, ttl in waiting.values()):
+                break
+
+        if all(None not in answers[host][:reached[host] - 1] for host, address in addresses.items()
+               if address is not None):
+            break
+
+    paths = {}
+    for host, hop_addresses in answers.items():
+        hop_addresses = hop_addresses[:reached[host]]
+        while hop_addresses and hop_addresses[-1] is None:
+            hop_addresses.pop()
+        paths[host] = hop_addresses
+    return paths
@@ -0,0 +1,401 @@
+import errno
+import os
+import random
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+import itertools
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ICMP message types we send and expect back, per address family
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTO = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+ICMP_TIME_EXCEEDED = {socket.AF_INET: 11, socket.AF_INET6: 3}
+
+# Path mode sends echo requests with a short TTL (hop limit) and hears back from the router where it ran out.
+# Linux only passes those ICMP errors to datagram ICMP sockets through the socket's error queue, with the
+# router's address in an IP_RECVERR control message. Python doesn't name every constant involved.
+TTL_OPTIONS = {socket.AF_INET: (socket.IPPROTO_IP, socket.IP_TTL),
+               socket.AF_INET6: (socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS)}
+RECVERR_OPTIONS = {socket.AF_INET: (socket.IPPROTO_IP, 11), socket.AF_INET6: (socket.IPPROTO_IPV6, 25)}
+SOCK_EXTENDED_ERR = struct.Struct('=IBBBBII')  # errno, origin, ICMP type, code, pad, info, data
+IPV6_HEADER_SIZE = 40
+
+ECHO_PAYLOAD = b'proPing'.ljust(56, b'.')  # Same payload size as the system ping
+LOOPBACK_TARGET = '127.0.0.1'
+
+# For hosts that firewall ICMP: the tcp probe times a TCP connect to a port, the udp probe an echo of a
+# sequence-stamped datagram. The udp probe needs something answering on the port (the echo service, or
+# echo.py).
+DEFAULT_PORTS = {'tcp': 443, 'udp': 7}
+UDP_HEADER = struct.Struct('!8sIH')  # Magic, probe identifier, sequence number
+UDP_MAGIC = b'proPingU'
+
+# Identifiers handed out to each IcmpProbe, so several probes sharing a raw socket view don't steal each other's replies
+_identifiers = itertools.count((os.getpid() & 0xffff) << 8)
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def open_icmp_socket(family=socket.AF_INET):
+    # Prefer the unprivileged datagram ICMP socket (macOS, Linux with ping_group_range set),
+    # and fall back to a raw socket when we are allowed one
+    errors = []
+    for kind, sock_type in (('dgram', socket.SOCK_DGRAM), ('raw', socket.SOCK_RAW)):
+        try:
+            sock = socket.socket(family, sock_type, ICMP_PROTO[family])
+        except OSError as e:
+            errors.append(f'{kind}: {e}')
+            continue
+        sock.setblocking(False)
+        return sock, kind
+    raise OSError(f"Unable to open an ICMP socket ({'; '.join(errors)})")
+
+
+class IcmpProbe:
+    name = 'icmp'
+
+    def __init__(self, family=socket.AF_INET, timeout=1.0):
+        self.family = family
+        self.timeout = timeout
+        self.sock, self.kind = open_icmp_socket(family)
+        self.identifier = next(_identifiers) & 0xffff
+        self.sequence = 0
+        self.default_ttl = self.ttl = self.sock.getsockopt(*TTL_OPTIONS[family])
+        self.error_queue = self.kind == 'dgram' and sys.platform.startswith('linux')
+        if self.error_queue:
+            self.sock.setsockopt(*RECVERR_OPTIONS[family], 1)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def next_sequence(self):
+        # Everything sending over this probe (the scheduler, path discovery, the self-test) numbers its probes
+        # from this one counter, so a late reply to one of them can't be taken for a reply to another
+        self.sequence = (self.sequence + 1) & 0xffff
+        return self.sequence
+
+    def send(self, address, sequence, ttl=None):
+        # ttl limits how many routers the probe may pass; None for the system default
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl != self.ttl:
+            self.sock.setsockopt(*TTL_OPTIONS[self.family], ttl)
+            self.ttl = ttl
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST[self.family], 0, 0, self.identifier, sequence)
+        if self.family == socket.AF_INET:
+            # The kernel fills in the ICMPv6 checksum for us, but not the IPv4 one
+            header = header[:2] + struct.pack('!H', checksum(header + ECHO_PAYLOAD)) + header[4:]
+        send_time = time.perf_counter()
+        self.sock.sendto(header + ECHO_PAYLOAD, (address, 0))
+
+        if self.kind == 'dgram' and sys.platform.startswith('linux'):
+            # Linux rewrites the identifier of datagram ICMP sockets to the socket's local port
+            self.identifier = self.sock.getsockname()[1]
+        return send_time
+
+    def receive(self):
+        # Drain everything waiting on the socket and return the echo replies that belong to us, along with
+        # the time exceeded errors our TTL-limited probes caused (from the router, not the probed address)
+        replies = []
+        while True:
+            try:
+                packet, sender = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue  # The error an earlier probe caused, read from the error queue below
+            recv_time = time.perf_counter()
+
+            # Raw IPv4 sockets (and datagram ones on macOS) hand us the IP header as well
+            if self.family == socket.AF_INET and packet and packet[0] >> 4 == 4:
+                packet = packet[(packet[0] & 0x0f) * 4:]
+            if len(packet) < 8:
+                continue
+
+            icmp_type, code, _, identifier, sequence = struct.unpack('!BBHHH', packet[:8])
+            if icmp_type == ICMP_TIME_EXCEEDED[self.family]:
+                # The router quotes the start of our probe: its IP header, then the ICMP header
+                quoted = packet[8:]
+                if self.family == socket.AF_INET:
+                    quoted = quoted[(quoted[0] & 0x0f) * 4:] if quoted else b''
+                else:
+                    quoted = quoted[IPV6_HEADER_SIZE:]
+                if len(quoted) < 8:
+                    continue
+                icmp_type, code, _, identifier, sequence = struct.unpack('!BBHHH', quoted[:8])
+                if icmp_type != ICMP_ECHO_REQUEST[self.family] or identifier != self.identifier:
+                    continue
+            elif icmp_type != ICMP_ECHO_REPLY[self.family] or identifier != self.identifier:
+                continue
+            replies.append((sender[0], sequence, recv_time))
+
+        if self.error_queue:
+            self._receive_errors(replies)
+        return replies
+
+    def _receive_errors(self, replies):
+        # Our probe's ICMP header comes back as the data, the router's address after the sock_extended_err
+        while True:
+            try:
+                packet, ancdata, _, _ = self.sock.recvmsg(2048, 512, socket.MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            recv_time = time.perf_counter()
+            if len(packet) < 8:
+                continue
+            icmp_type, code, _, identifier, sequence = struct.unpack('!BBHHH', packet[:8])
+            if icmp_type != ICMP_ECHO_REQUEST[self.family]:
+                continue
+            for level, cmsg_type, data in ancdata:
+                if (level, cmsg_type) != RECVERR_OPTIONS[self.family] or len(data) < SOCK_EXTENDED_ERR.size:
+                    continue
+                if SOCK_EXTENDED_ERR.unpack_from(data)[2] != ICMP_TIME_EXCEEDED[self.family]:
+                    continue
+                # The router's sockaddr_in or sockaddr_in6
+                offender = data[SOCK_EXTENDED_ERR.size:]
+                address = offender[4:8] if self.family == socket.AF_INET else offender[8:24]
+                replies.append((socket.inet_ntop(self.family, address), sequence, recv_time))
+
+    def ping(self, host):
+        return echo_ping(self, host)
+
+
+def echo_ping(probe, host):
+    # One blocking round trip with a probe that has send/receive, for the self-test
+    try:
+        address = socket.getaddrinfo(host, None, probe.family)[0][4][0]
+        sequence = probe.next_sequence()
+        send_time = probe.send(address, sequence)
+    except OSError:
+        return 'Error'
+
+    deadline = send_time + probe.timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return '100'
+        readable, _, _ = select.select([probe.sock], [], [], remaining)
+        if not readable:
+            continue
+        for sender, reply_sequence, recv_time in probe.receive():
+            if reply_sequence == sequence and sender == address:
+                return '0'
+
+
+class UdpProbe:
+    # Sends sequence-stamped datagrams to a UDP echo service from one non-blocking socket, and matches the
+    # echoes by sequence number just like the ICMP probe matches its replies
+    name = 'udp'
+
+    def __init__(self, family=socket.AF_INET, port=DEFAULT_PORTS['udp'], timeout=1.0):
+        self.family = family
+        self.port = port
+        self.timeout = timeout
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.identifier = random.getrandbits(32)  # Tells our echoes apart from anything else arriving
+        self.sequence = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def next_sequence(self):
+        self.sequence = (self.sequence + 1) & 0xffff
+        return self.sequence
+
+    def send(self, address, sequence):
+        payload = UDP_HEADER.pack(UDP_MAGIC, self.identifier, sequence).ljust(len(ECHO_PAYLOAD), b'.')
+        send_time = time.perf_counter()
+        self.sock.sendto(payload, (address, self.port))
+        return send_time
+
+    def receive(self):
+        replies = []
+        while True:
+            try:
+                packet, sender = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return replies
+            except OSError:
+                continue  # An ICMP port unreachable for an earlier datagram; the probe just times out
+            recv_time = time.perf_counter()
+            if len(packet) < UDP_HEADER.size:
+                continue
+            magic, identifier, sequence = UDP_HEADER.unpack_from(packet)
+            if magic != UDP_MAGIC or identifier != self.identifier:
+                continue
+            replies.append((sender[0], sequence, recv_time))
+
+    def ping(self, host):
+        return echo_ping(self, host)
+
+
+class TcpProbe:
+    # Times the TCP handshake with a port. Every probe is its own non-blocking socket whose connect the
+    # scheduler waits on with its selector, so hundreds can be in flight without a thread each. A refused
+    # connection still means the host answered, so it counts as a reply like an accepted one.
+    name = 'tcp'
+
+    def __init__(self, family=socket.AF_INET, port=DEFAULT_PORTS['tcp'], timeout=1.0):
+        self.family = family
+        self.port = port
+        self.timeout = timeout
+        raise_file_limit()
+
+    def close(self):
+        pass
+
+    def connect(self, address):
+        # Start a connect; returns (socket, send time). The socket becomes writable once it has completed.
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        # Reset instead of the FIN handshake on close, so thousands of probes don't pile up in TIME_WAIT
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        send_time = time.perf_counter()
+        error = sock.connect_ex((address, self.port))
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise OSError(error, os.strerror(error))
+        return sock, send_time
+
+    def finish(self, sock):
+        # (result, receive time) of a connect that has completed, and closes the socket
+        recv_time = time.perf_counter()
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        sock.close()
+        return ('0' if error in (0, errno.ECONNREFUSED) else 'Error'), recv_time
+
+    def ping(self, host):
+        try:
+            address = socket.getaddrinfo(host, None, self.family)[0][4][0]
+            sock, send_time = self.connect(address)
+        except OSError:
+            return 'Error'
+        _, writable, _ = select.select([], [sock], [], self.timeout)
+        if not writable:
+            sock.close()
+            return '100'
+        return self.finish(sock)[0]
+
+
+class SubprocessProbe:
+    name = 'subprocess'
+    timeout = 1.0
+
+    def __init__(self, family=socket.AF_INET):
+        self.family = family
+
+    def close(self):
+        pass
+
+    def command(self, host):
+        if self.family == socket.AF_INET6:
+            return ['ping6' if sys.platform == 'darwin' else 'ping', *([] if sys.platform == 'darwin' else ['-6']),
+                    '-c 1', '-q', host]
+        return ['ping', '-c 1', '-t 1', '-q', host]
+
+    def start(self, host):
+        # Launch the system ping without waiting for it, so a scheduler can keep several running at once
+        return subprocess.Popen(self.command(host),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+
+    def parse(self, output, returncode):
+        # Returns (packet loss, round-trip time in seconds or None)
+        if returncode != 0:
+            return 'Error', None
+        # The summary line is 'round-trip min/avg/max/stddev = ...' on macOS and 'rtt min/avg/max/mdev = ...' on Linux
+        rtt_info = [line for line in output.split('\n') if 'min/avg/max' in line]
+        rtt = float(rtt_info[0].split('=')[1].split('/')[1]) / 1000 if rtt_info else None
+        packet_loss_info = [line for line in output.split('\n') if 'packet loss' in line]
+        if packet_loss_info:
+            packet_loss = packet_loss_info[0].split('%')[0].split(' ')[-1]
+            return packet_loss, rtt
+        else:
+            return 'N/A', rtt
+
+    def ping(self, host):
+        try:
+            output = subprocess.check_output(self.command(host),
+                                             stderr=subprocess.STDOUT,
+                                             universal_newlines=True)
+        except subprocess.CalledProcessError as e:
+            return self.parse(e.output, e.returncode)[0]
+        except OSError:
+            return 'Error'
+        return self.parse(output, 0)[0]
+
+
+PROBE_BACKENDS = ('auto', 'icmp', 'subprocess', 'tcp', 'udp')
+
+
+def raise_file_limit(wanted=65536):
+    # Every TCP connect in flight holds a file descriptor, and the usual soft limit of 1024 is soon reached
+    # with many hosts at high rates. Lift it towards the hard limit, which needs no privileges.
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        if soft != resource.RLIM_INFINITY and soft < limit:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    except (OSError, ValueError):
+        pass  # Some systems cap it lower than they report (macOS); keep what we have
+
+
+def make_probe(backend='auto', family=socket.AF_INET, port=None):
+    if backend in DEFAULT_PORTS:
+        probe_class = TcpProbe if backend == 'tcp' else UdpProbe
+        return probe_class(family, port if port is not None else DEFAULT_PORTS[backend])
+    if backend == 'subprocess':
+        return SubprocessProbe(family)
+    try:
+        return IcmpProbe(family)
+    except OSError:
+        if backend == 'icmp':
+            raise
+        # No ICMP socket for us on this machine, so fall back to the system ping
+        return SubprocessProbe(family)
+
+
+def self_test(backend='auto', count=5):
+    # Probe the loopback interface, which needs no network and should never lose a packet. The tcp and udp
+    # probes get a local echo server to talk to.
+    server = None
+    if backend in DEFAULT_PORTS:
+        from echo import TcpEchoServer, UdpEchoServer
+        server = (TcpEchoServer if backend == 'tcp' else UdpEchoServer)(LOOPBACK_TARGET).start()
+    probe = make_probe(backend, port=server.port if server is not None else None)
+    mode = f'{probe.name} ({probe.kind} socket)' if isinstance(probe, IcmpProbe) else probe.name
+    where = f' port {probe.port} (local echo server)' if server is not None else ''
+    print(f'Probing {LOOPBACK_TARGET}{where} with the {mode} backend')
+    results = []
+    for _ in range(count):
+        result = probe.ping(LOOPBACK_TARGET)
+        results.append(result)
+        print(f'  packet loss: {result}%')
+    probe.close()
+    if server is not None:
+        server.stop()
+    return all(result == '0' for result in results)
@@ -0,0 +1,91 @@
+import socket
+import threading
+import time
+
+ADDRESS_FAMILIES = {'ipv4': socket.AF_INET, 'ipv6': socket.AF_INET6}
+DNS_REFRESH_SECONDS = 60
+DNS_RETRY_SECONDS = 5
+
+
+def resolve(host, family=socket.AF_INET):
+    # (address, seconds the lookup took) for host in the given address family; raises socket.gaierror
+    start = time.perf_counter()
+    address = socket.getaddrinfo(host, None, family, socket.SOCK_DGRAM)[0][4][0]
+    return address, time.perf_counter() - start
+
+
+class Resolver:
+    # Keeps every target's address in a cache, so probes never wait on (or hammer) the resolver.
+    # getaddrinfo does not tell us the record's TTL, so each name is looked up again every refresh_seconds
+    # on a background thread, and retried every retry_seconds while it fails. A failed lookup keeps the last
+    # good address, so probing carries on through a DNS outage and it shows up in the DNS metrics instead
+    # of as packet loss.
+    def __init__(self, targets, family=socket.AF_INET, refresh_seconds=DNS_REFRESH_SECONDS,
+                 retry_seconds=DNS_RETRY_SECONDS, on_resolved=None):
+        self.targets = list(targets)
+        self.family = family
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.on_resolved = on_resolved  # Called with (target, address, seconds, error) after every lookup
+
+        self.addresses = {}  # target -> address; read by the scheduler thread, written by the refresh thread
+        self.next_refresh = {}
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def address(self, target):
+        return self.addresses.get(target)
+
+    def refresh(self, target):
+        # Look target up now; returns the error message, or None when it resolved
+        try:
+            address, seconds = resolve(target, self.family)
+        except (OSError, UnicodeError) as e:
+            self.next_refresh[target] = time.monotonic() + self.retry_seconds
+            if self.on_resolved is not None:
+                self.on_resolved(target, self.addresses.get(target), None, str(e))
+            return str(e)
+        self.addresses[target] = address
+        self.next_refresh[target] = time.monotonic() + self.refresh_seconds
+        if self.on_resolved is not None:
+            self.on_resolved(target, address, seconds, None)
+        return None
+
+    def seed(self, target, address, seconds):
+        # Take a lookup made elsewhere (proPing checking the names before it starts) as target's first one
+        self.addresses[target] = address
+        self.next_refresh[target] = time.monotonic() + self.refresh_seconds
+        if self.on_resolved is not None:
+            self.on_resolved(target, address, seconds, None)
+
+    def resolve_all(self):
+        # Resolve every target now, on the calling thread; returns {target: error} for the ones that failed
+        errors = {}
+        for target in self.targets:
+            error = self.refresh(target)
+            if error is not None:
+                errors[target] = error
+        return errors
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='Resolver', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+            self.thread = None
+
+    def run(self):
+        for target in self.targets:
+            self.next_refresh.setdefault(target, 0.0)
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            for target in self.targets:
+                if self.next_refresh[target] <= now:
+                    self.refresh(target)
+                    if self.stop_event.is_set():
+                        return
+            self.stop_event.wait(max(0.0, min(self.next_refresh.values()) - time.monotonic()))
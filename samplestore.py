@@ -0,0 +1,98 @@
+import numpy as np
+
+# What happened to a probe, stored as one byte per sample
+STATUS_REPLY = 0
+STATUS_LOST = 1
+STATUS_ERROR = 2
+
+LOSS_BY_STATUS = np.array([0.0, 100.0, 100.0])  # Packet loss percentage each status counts as
+
+
+def sample_status(result):
+    # Map a probe result string ('0', '100', 'Error', 'N/A', ...) to a status
+    try:
+        return STATUS_REPLY if float(result) == 0 else STATUS_LOST
+    except ValueError:
+        return STATUS_ERROR
+
+
+class SampleStore:
+    # Fixed-capacity ring buffer of probe samples held in typed arrays: timestamps as int64 nanoseconds,
+    # round-trip time as float32 seconds (NaN when there was no reply) and the status as uint8.
+    # That is 13 bytes a sample instead of ~100 for a tuple of Python floats in a deque.
+    # Samples arrive in time order, so the buffer is two sorted runs and range queries are binary searches.
+    # Weights (see ProbeScheduler) take another 4 bytes a sample, but only once a sample is not of weight 1.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.rtts = np.zeros(capacity, dtype=np.float32)
+        self.statuses = np.zeros(capacity, dtype=np.uint8)
+        self.weights = None  # float32, all 1 until then
+        self.head = 0  # Where the next sample goes
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        nbytes = self.timestamps.nbytes + self.rtts.nbytes + self.statuses.nbytes
+        return nbytes if self.weights is None else nbytes + self.weights.nbytes
+
+    def append(self, timestamp, status, rtt=None, weight=1.0):
+        head = self.head
+        self.timestamps[head] = int(timestamp * 1e9)
+        self.rtts[head] = np.nan if rtt is None else rtt
+        self.statuses[head] = status
+        if self.weights is not None or weight != 1.0:
+            if self.weights is None:
+                self.weights = np.ones(self.capacity, dtype=np.float32)
+            self.weights[head] = weight
+        self.head = (head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def extend(self, timestamps_ns, statuses, rtts, weights):
+        # Append a batch of samples (int64 nanosecond timestamps, statuses, float rtts with NaN for none,
+        # weights) with at most two slice assignments per array
+        if len(timestamps_ns) > self.capacity:
+            timestamps_ns, statuses, rtts, weights = (timestamps_ns[-self.capacity:], statuses[-self.capacity:],
+                                                      rtts[-self.capacity:], weights[-self.capacity:])
+        if self.weights is None and (weights != 1).any():
+            self.weights = np.ones(self.capacity, dtype=np.float32)
+        done = 0
+        while done < len(timestamps_ns):
+            take = min(len(timestamps_ns) - done, self.capacity - self.head)
+            part = slice(self.head, self.head + take)
+            self.timestamps[part] = timestamps_ns[done:done + take]
+            self.statuses[part] = statuses[done:done + take]
+            self.rtts[part] = rtts[done:done + take]
+            if self.weights is not None:
+                self.weights[part] = weights[done:done + take]
+            self.head = (self.head + take) % self.capacity
+            done += take
+        self.count = min(self.capacity, self.count + len(timestamps_ns))
+
+    def _segments(self):
+        # The stored samples as slices in chronological order: one run until the buffer wraps, then two
+        if self.count < self.capacity:
+            return [slice(0, self.count)]
+        return [slice(self.head, self.capacity), slice(0, self.head)]
+
+    def packet_loss(self, start, end=None):
+        # (sum of packet loss percentages times weights, sum of weights) over the samples with
+        # start <= timestamp < end, one vectorized pass over each run of the buffer
+        start_ns = int(start * 1e9)
+        end_ns = np.iinfo(np.int64).max if end is None else int(end * 1e9)
+        loss_sum, weight_sum = 0.0, 0.0
+        for segment in self._segments():
+            lo, hi = np.searchsorted(self.timestamps[segment], (start_ns, end_ns))
+            losses = LOSS_BY_STATUS[self.statuses[segment][lo:hi]]
+            if self.weights is None:
+                loss_sum += float(losses.sum())
+                weight_sum += int(hi - lo)
+            else:
+                weights = self.weights[segment][lo:hi]
+                loss_sum += float(np.dot(losses, weights))
+                weight_sum += float(weights.sum())
+        return loss_sum, weight_sum
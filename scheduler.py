@@ -0,0 +1,372 @@
+import errno
+import math
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from path import Hop
+from probes import IcmpProbe, TcpProbe, UdpProbe
+from resolver import Resolver
+from instrumentation import Instrumentation
+
+clock = time.perf_counter  # Monotonic, and the clock the probes stamp their send/receive times with
+
+
+class TimerWheel:
+    # A hashed timer wheel: timers land in the slot for their tick, and advancing the clock only
+    # visits the slots between the last tick and now. Scheduling is O(1), and firing is O(1) per timer
+    # plus the slots passed, at most one rotation.
+    def __init__(self, resolution=0.001, num_slots=1024, now=None):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(num_slots)]
+        self.tick = int((clock() if now is None else now) / resolution)  # Every tick before this one has fired
+
+    def schedule(self, deadline, callback, *args):
+        tick = max(math.ceil(deadline / self.resolution), self.tick)  # Never fire early, never in the past
+        entry = [tick, callback, args]
+        self.slots[tick % len(self.slots)].append(entry)
+        return entry
+
+    def cancel(self, entry):
+        entry[1] = None  # Dropped lazily the next time its slot is visited
+
+    def next_deadline(self):
+        # Walks the slots up to the first one with a timer due within this rotation, so it is bounded by the
+        # number of slots; only when nothing is due for a whole rotation does it scan every timer
+        num_slots = len(self.slots)
+        for tick in range(self.tick, self.tick + num_slots):
+            for entry in self.slots[tick % num_slots]:
+                if entry[1] is not None and entry[0] == tick:
+                    return tick * self.resolution
+        # Nothing due within one rotation, so look at the later rounds too
+        ticks = [entry[0] for slot in self.slots for entry in slot if entry[1] is not None]
+        return min(ticks) * self.resolution if ticks else None
+
+    def advance(self, now):
+        now_tick = int(now / self.resolution)
+        if now_tick < self.tick:
+            return
+
+        num_slots = len(self.slots)
+        if now_tick - self.tick >= num_slots:
+            ticks = range(num_slots)  # We slept through a whole rotation, visit every slot once
+        else:
+            ticks = range(self.tick, now_tick + 1)
+
+        due = []
+        for tick in ticks:
+            index = tick % num_slots
+            slot = self.slots[index]
+            if not slot:
+                continue
+            waiting = []
+            for entry in slot:
+                if entry[1] is None:
+                    continue
+                (due if entry[0] <= now_tick else waiting).append(entry)
+            self.slots[index] = waiting
+        self.tick = now_tick + 1
+
+        due.sort(key=lambda entry: entry[0])
+        for entry in due:
+            callback, args = entry[1], entry[2]
+            if callback is not None:
+                entry[1] = None
+                callback(*args)
+
+
+class ProbeScheduler:
+    # Drives every probe to every target from one thread: a selector waits on the probe socket (or the
+    # pending TCP connects, or the pipes of running ping processes) and a timer wheel issues sends on a
+    # fixed, drift-free grid and expires unanswered probes. Each target has its own grid, probing it
+    # ping_frequency times a second (or at the rate rate_controller picks for it), and the grids start
+    # spread evenly across one interval so sends never bunch up. Probes go to the addresses in resolver's
+    # cache; the scheduler itself never waits on DNS. A target can also be a path.Hop, probed with a TTL that
+    # expires at that router (ICMP only).
+    def __init__(self, targets, ping_frequency, probe, on_result, resolver=None, instrumentation=None,
+                 rate_controller=None, hop_addresses=None):
+        self.targets = list(targets)
+        self.ping_frequency = ping_frequency
+        self.probe = probe
+        self.on_result = on_result
+        self.rate_controller = rate_controller
+
+        self.selector = selectors.DefaultSelector()
+        self.wheel = None
+        self.thread = None
+        self.running = False
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+
+        self.resolver = resolver if resolver is not None else Resolver(self.targets, getattr(probe, 'family', socket.AF_INET))
+        self.in_flight = {}  # sequence -> (target, address or None for a hop, send_time, timeout timer, weight)
+        self.connecting = {}  # TCP probe socket -> (target, send_time, timeout timer, weight)
+        self.subprocesses = []  # State of the ping processes still running
+        self.grids = {}  # target -> [anchor, sends, interval, send timer]
+        self.new_targets = deque()  # Lists of targets added by other threads, waiting for the scheduler thread
+        # Hop -> the router that last answered for it. Read by other threads for display.
+        self.hop_addresses = hop_addresses if hop_addresses is not None else {}
+        self.max_lag = 0.1  # Seconds
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+
+    def start(self):
+        if not self.resolver.addresses:
+            self.resolver.resolve_all()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='ProbeScheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.5):
+        self.running = False
+        self._wake()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+
+    def add_targets(self, targets):
+        # Start probing more targets, from any thread, e.g. the hops path discovery found after probing began
+        self.new_targets.append(list(targets))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b'\x00')
+        except OSError:
+            pass
+
+    def run(self):
+        self.wheel = TimerWheel()
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        if isinstance(self.probe, (IcmpProbe, UdpProbe)):
+            self.selector.register(self.probe.fileno(), selectors.EVENT_READ, self._read_replies)
+
+        self._start_grids(self.targets)
+
+        try:
+            while self.running:
+                while self.new_targets:
+                    targets = self.new_targets.popleft()
+                    self.targets += targets
+                    self._start_grids(targets)
+                now = clock()
+                deadline = self.wheel.next_deadline()
+                timeout = None if deadline is None else max(0.0, deadline - now)
+                for key, _ in self.selector.select(timeout):
+                    if key.data is None:
+                        self._drain_wakeup()
+                    else:
+                        key.data(key)
+                self.wheel.advance(clock())
+        finally:
+            for state in list(self.subprocesses):
+                self._kill_subprocess(state, report=False)
+            for sock in self.connecting:
+                sock.close()
+            self.selector.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
+
+    def _start_grids(self, targets):
+        # The targets' first probes are spread evenly across one interval from now
+        if not targets:
+            return
+        start_time = clock()
+        stagger = 1 / self.ping_frequency / len(targets)
+        for i, target in enumerate(targets):
+            anchor = start_time + i * stagger
+            rate = self.rate_controller.rates[target] if self.rate_controller is not None else self.ping_frequency
+            self.grids[target] = [anchor, 0, 1 / rate, self.wheel.schedule(anchor, self._send_next, target)]
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(64):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _send_next(self, target):
+        # Send times sit on the target's grid, so scheduling latency never accumulates. Every slot that has
+        # come due is sent, which keeps the rate exact when the interval is shorter than a timer tick. Slots
+        # more than max_lag in the past (the machine slept, say) are skipped rather than sent in a burst.
+        grid = self.grids[target]
+        anchor, sends, interval, _ = grid
+        now = clock()
+        oldest_allowed = int((now - self.max_lag - anchor) / interval)
+        if sends < oldest_allowed:
+            self.instrumentation.count('skipped', oldest_allowed - sends)
+            sends = oldest_allowed
+
+        # Each result counts for the time its probe stands for, relative to the base rate, so loss averages
+        # stay comparable when the rate changes
+        weight = self.ping_frequency * interval
+        while anchor + sends * interval <= now:
+            scheduled = anchor + sends * interval
+            sends += 1
+            grid[1] = sends
+            if isinstance(self.probe, (IcmpProbe, UdpProbe)):
+                self._send_echo(target, scheduled, weight)
+            elif isinstance(self.probe, TcpProbe):
+                self._send_connect(target, scheduled, weight)
+            else:
+                self._start_subprocess(target, scheduled, weight)
+            if grid[2] != interval:
+                return  # A send error changed the rate, and _set_rate has rescheduled us
+
+        grid[1] = sends
+        grid[3] = self.wheel.schedule(anchor + sends * interval, self._send_next, target)
+
+    def _set_rate(self, target, rate):
+        # Re-anchor the target's grid so the next probe goes out one new interval after the last one, or
+        # right away if that moment has passed (speeding up from a slow rate)
+        grid = self.grids[target]
+        anchor, sends, interval, timer = grid
+        self.wheel.cancel(timer)
+        new_interval = 1 / rate
+        grid[:] = [max(anchor + (sends - 1) * interval, clock() - new_interval), 1, new_interval, None]
+        grid[3] = self.wheel.schedule(grid[0] + new_interval, self._send_next, target)
+
+    def _report(self, target, result, rtt=None, weight=1.0):
+        self.on_result((target, time.time(), result, rtt, weight))
+        if self.rate_controller is not None:
+            rate = self.rate_controller.observe(target, clock(), result != '0', rtt)
+            if rate is not None:
+                self._set_rate(target, rate)
+
+    def _send_echo(self, target, scheduled, weight):
+        hop = type(target) is Hop
+        address = self.resolver.address(target.host if hop else target)
+        if address is None:
+            self.instrumentation.count('send_errors')
+            self._report(target, 'Error', weight=weight)  # Never resolved; the resolver keeps retrying
+            return
+        if len(self.in_flight) > 0xffff:
+            self.instrumentation.count('send_errors')
+            self._report(target, 'Error', weight=weight)  # Every sequence number is waiting for its reply
+            return
+        try:
+            # One sequence counter across all targets, the probe's, so a sequence number alone identifies
+            # the probe. At high rates it wraps round within a timeout, so skip numbers still in flight.
+            sequence = self.probe.next_sequence()
+            while sequence in self.in_flight:
+                sequence = self.probe.next_sequence()
+            if hop:
+                send_time = self.probe.send(address, sequence, target.ttl)
+            else:
+                send_time = self.probe.send(address, sequence)
+        except OSError:
+            self.instrumentation.count('send_errors')
+            self._report(target, 'Error', weight=weight)
+            return
+        self.instrumentation.count('sent')
+        self.instrumentation.send_skew.add(send_time - scheduled)
+        timer = self.wheel.schedule(send_time + self.probe.timeout, self._expire, sequence)
+        # Whichever router the TTL runs out at answers for a hop, so its sender isn't checked
+        self.in_flight[sequence] = (target, None if hop else address, send_time, timer, weight)
+
+    def _read_replies(self, key):
+        for sender, sequence, recv_time in self.probe.receive():
+            pending = self.in_flight.get(sequence)
+            if pending is None or (pending[1] is not None and sender != pending[1]):
+                # Late reply to a probe we already counted as lost, a duplicate, or not ours
+                self.instrumentation.count('late_replies')
+                continue
+            del self.in_flight[sequence]
+            target, address, send_time, timer, weight = pending
+            self.wheel.cancel(timer)
+            if address is None:
+                self.hop_addresses[target] = sender
+            self._report(target, '0', recv_time - send_time, weight)
+
+    def _expire(self, sequence):
+        pending = self.in_flight.pop(sequence, None)
+        if pending is not None:
+            self._report(pending[0], '100', weight=pending[4])
+
+    def _send_connect(self, target, scheduled, weight):
+        address = self.resolver.address(target)
+        if address is None:
+            self.instrumentation.count('send_errors')
+            self._report(target, 'Error', weight=weight)
+            return
+        try:
+            sock, send_time = self.probe.connect(address)
+        except OSError as e:
+            if e.errno in (errno.EMFILE, errno.ENFILE):
+                # Out of file descriptors, with too many connects in flight: our shortage, not the network's,
+                # so the probe is skipped like one the scheduler fell behind on rather than counted as lost
+                self.instrumentation.count('skipped')
+                return
+            self.instrumentation.count('send_errors')
+            self._report(target, 'Error', weight=weight)
+            return
+        self.instrumentation.count('sent')
+        self.instrumentation.send_skew.add(send_time - scheduled)
+        timer = self.wheel.schedule(send_time + self.probe.timeout, self._expire_connect, sock)
+        self.connecting[sock] = (target, send_time, timer, weight)
+        self.selector.register(sock, selectors.EVENT_WRITE, self._connected)
+
+    def _connected(self, key):
+        sock = key.fileobj
+        target, send_time, timer, weight = self.connecting.pop(sock)
+        self.selector.unregister(sock)
+        self.wheel.cancel(timer)
+        result, recv_time = self.probe.finish(sock)
+        self._report(target, result, recv_time - send_time if result == '0' else None, weight)
+
+    def _expire_connect(self, sock):
+        target, _, _, weight = self.connecting.pop(sock)
+        self.selector.unregister(sock)
+        sock.close()
+        self._report(target, '100', weight=weight)
+
+    def _start_subprocess(self, target, scheduled, weight):
+        address = self.resolver.address(target)
+        if address is None:
+            self.instrumentation.count('send_errors')
+            self._report(target, 'Error', weight=weight)
+            return
+        try:
+            process = self.probe.start(address)
+        except OSError:
+            self.instrumentation.count('send_errors')
+            self._report(target, 'Error', weight=weight)
+            return
+        self.instrumentation.count('sent')
+        self.instrumentation.send_skew.add(clock() - scheduled)
+        os.set_blocking(process.stdout.fileno(), False)
+        state = {'target': target, 'process': process, 'output': [], 'weight': weight}
+        self.subprocesses.append(state)
+        state['timer'] = self.wheel.schedule(clock() + self.probe.timeout + 1, self._kill_subprocess, state)
+        self.selector.register(process.stdout, selectors.EVENT_READ, lambda key: self._read_subprocess(state))
+
+    def _read_subprocess(self, state):
+        process = state['process']
+        try:
+            chunk = os.read(process.stdout.fileno(), 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        if chunk:
+            state['output'].append(chunk)
+            return
+
+        # EOF, the ping has finished
+        self.subprocesses.remove(state)
+        self.selector.unregister(process.stdout)
+        self.wheel.cancel(state['timer'])
+        process.stdout.close()
+        returncode = process.wait()
+        result, rtt = self.probe.parse(b''.join(state['output']).decode(errors='replace'), returncode)
+        self._report(state['target'], result, rtt, state['weight'])
+
+    def _kill_subprocess(self, state, report=True):
+        process = state['process']
+        self.subprocesses.remove(state)
+        self.selector.unregister(process.stdout)
+        process.kill()
+        process.stdout.close()
+        process.wait()
+        if report:
+            self.instrumentation.count('subprocess_timeouts')
+            self._report(state['target'], '100', weight=state['weight'])
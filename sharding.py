@@ -0,0 +1,260 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time
+from collections import deque, namedtuple
+
+from adaptive import RateController
+from aggregation import JitterEstimator, LatencySketch, RttHistogram
+from incidents import IncidentDetector, IncidentLog
+from instrumentation import Instrumentation
+from probes import make_probe
+from resolver import Resolver
+from samplestore import STATUS_ERROR, STATUS_REPLY, sample_status
+from scheduler import ProbeScheduler
+from storage import SampleLog
+
+# With --workers the hosts are split across worker processes, each with its own scheduler, probe socket
+# and GIL. A worker folds its results into one summary per host per second and sends those to the parent
+# over a pipe, so the parent (and the GUI thread) handles a few numbers per host per second no matter how
+# fast the hosts are probed. Workers also run the incident detectors and write the sample log for their
+# hosts, since both need every sample; the parent only hears about the incidents.
+
+FOLD_INTERVAL = 0.1  # Seconds between a worker folding in its new results
+
+log = logging.getLogger('proping')
+
+# What a worker sends its parent about once a second:
+#   summaries        (host, second, [replies, lost, errors], weighted loss sum, weight, latency sketch counts,
+#                    rtt histogram counts, rtt sum, jitter sum, jitter count, jitter or None) per host and second
+#   incidents        (event, Incident.to_dict()) for incidents opened, escalated, closed or updated
+#   resolved         (target, address, seconds, error) per DNS lookup
+#   instrumentation  Instrumentation.snapshot() of the worker
+#   rates            host -> probes per second, in adaptive mode
+ShardReport = namedtuple('ShardReport', 'worker timestamp summaries incidents resolved instrumentation rates')
+
+
+class SecondSummary:
+    # The samples of one host within one second, as the parent's TargetState needs them
+    __slots__ = ('counts', 'loss_sum', 'weight', 'latency', 'histogram', 'jitter_sum', 'jitter_count')
+
+    def __init__(self):
+        self.counts = [0, 0, 0]
+        self.loss_sum = 0.0
+        self.weight = 0.0
+        self.latency = LatencySketch()
+        self.histogram = RttHistogram()
+        self.jitter_sum = 0.0
+        self.jitter_count = 0
+
+    def add(self, status, packet_loss, rtt, jitter, weight):
+        self.counts[status] += 1
+        self.loss_sum += packet_loss * weight
+        self.weight += weight
+        if rtt is not None:
+            self.latency.add(rtt)
+            self.histogram.add(rtt)
+            self.jitter_sum += jitter
+            self.jitter_count += 1
+
+    def to_tuple(self, host, second, jitter):
+        return (host, second, self.counts, self.loss_sum, self.weight, self.latency.counts, self.histogram.counts,
+                self.histogram.sum, self.jitter_sum, self.jitter_count, jitter)
+
+
+class ShardWorker:
+    # The body of one worker process: probes its share of the hosts and reports to the parent over conn
+    # until the parent sends 'stop'
+    def __init__(self, worker_id, conn, targets, options):
+        self.worker_id = worker_id
+        self.conn = conn
+        self.targets = list(targets)
+        self.options = options
+
+        self.results = deque()  # Appended by the scheduler thread, folded in by the main thread
+        self.resolved = deque()  # Appended by the resolver thread
+        self.open_seconds = {}  # (host, second) -> SecondSummary
+        self.jitter = {target: JitterEstimator() for target in self.targets}
+        self.incident_events = []
+        self.incident_log = IncidentLog()
+        self.incident_log.listeners.append(lambda event, incident: self.incident_events.append(
+            (event, incident.to_dict())))
+        self.detectors = {target: IncidentDetector(target, self.incident_log) for target in self.targets}
+        self.instrumentation = Instrumentation()
+        self.rate_controller = None
+        if options['adaptive']:
+            self.rate_controller = RateController(self.targets, options['ping_frequency'], options['burst_rate'],
+                                                  options['rate_budget'])
+        self.sample_log = None
+        self.target_logs = {}
+        if options['data_dir'] is not None:
+            self.sample_log = SampleLog(options['data_dir'], options['retention_days'])
+            self.target_logs = {target: self.sample_log.target_log(target) for target in self.targets}
+
+    def run(self):
+        probe = make_probe(self.options['probe_backend'], self.options['family'], self.options['probe_port'])
+        resolver = Resolver(self.targets, self.options['family'], self.options['dns_refresh'],
+                            on_resolved=lambda *lookup: self.resolved.append(lookup))
+        for target in self.targets:
+            if target in self.options['addresses']:
+                resolver.seed(target, *self.options['addresses'][target])
+        if not resolver.addresses:
+            resolver.resolve_all()
+        resolver.start()
+        scheduler = ProbeScheduler(self.targets, self.options['ping_frequency'], probe, self.results.append,
+                                   resolver, self.instrumentation, self.rate_controller)
+        scheduler.start()
+
+        last_second = int(time.time())
+        try:
+            while not (self.conn.poll(FOLD_INTERVAL) and self.conn.recv() == 'stop'):
+                self.fold()
+                now_second = int(time.time())
+                if now_second != last_second:
+                    self.ship(now_second)  # Every earlier second is complete, results arrive in time order
+                    last_second = now_second
+        finally:
+            scheduler.stop()
+            probe.close()
+            resolver.stop()
+            self.fold()
+            self.ship()
+            if self.sample_log is not None:
+                self.sample_log.close()
+
+    def fold(self):
+        results = self.results
+        for _ in range(len(results)):
+            target, timestamp, result, rtt, weight = results.popleft()
+            status = sample_status(result)
+            packet_loss = 0.0 if status == STATUS_REPLY else 100.0
+            jitter = self.jitter[target].add(rtt) if rtt is not None else 0.0
+            key = (target, int(timestamp))
+            summary = self.open_seconds.get(key)
+            if summary is None:
+                summary = self.open_seconds[key] = SecondSummary()
+            summary.add(status, packet_loss, rtt, jitter, weight)
+            self.detectors[target].add(timestamp, packet_loss, rtt, weight)
+            target_log = self.target_logs.get(target)
+            if target_log is not None:
+                target_log.append(timestamp, status, packet_loss, rtt, weight)
+
+    def ship(self, before_second=None):
+        # Send the summaries of the seconds before before_second (all of them when None) and everything else
+        # that happened since the last report
+        done = [key for key in self.open_seconds if before_second is None or key[1] < before_second]
+        summaries = [self.open_seconds.pop(key).to_tuple(*key, self.jitter[key[0]].jitter) for key in done]
+        # Open incidents go along every time, so the parent's copies keep counting samples
+        incidents = self.incident_events + [('updated', incident.to_dict()) for detector in self.detectors.values()
+                                            for incident in (detector.loss_incident, detector.latency_incident)
+                                            if incident is not None]
+        self.incident_events = []
+        resolved = [self.resolved.popleft() for _ in range(len(self.resolved))]
+        rates = dict(self.rate_controller.rates) if self.rate_controller is not None else None
+        self.conn.send(ShardReport(self.worker_id, time.time(), summaries, incidents, resolved,
+                                   self.instrumentation.snapshot(), rates))
+
+
+def worker_main(worker_id, conn, targets, options):
+    # Entry point of a worker process. Ctrl-C reaches the whole process group; the parent decides when we stop.
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_IGN)
+    try:
+        ShardWorker(worker_id, conn, targets, options).run()
+    except Exception as e:
+        conn.send(f'Worker {worker_id} ({os.getpid()}) failed: {e!r}')
+    finally:
+        conn.close()
+
+
+class ShardedProbing:
+    # Stands in for ProbeScheduler when the hosts are split across num_workers processes: starts the
+    # workers, and passes each ShardReport they send to on_report from a receiver thread
+    def __init__(self, targets, num_workers, options, on_report):
+        self.targets = list(targets)
+        self.num_workers = max(1, min(num_workers, len(self.targets)))
+        self.options = dict(options)
+        if options['rate_budget'] is not None:
+            # Shared equally by the workers actually started, which is fewer than asked with fewer hosts
+            self.options['rate_budget'] = options['rate_budget'] / self.num_workers
+        self.on_report = on_report
+        self.processes = []
+        self.conns = []
+        self.thread = None
+        self.stopping = False
+
+    def shards(self):
+        # Round robin, so hosts listed together (often on the same network) end up on different cores
+        return [self.targets[i::self.num_workers] for i in range(self.num_workers)]
+
+    def start(self):
+        # Spawned rather than forked: the parent has threads, and possibly Qt, that must not be copied
+        context = multiprocessing.get_context('spawn')
+        for worker_id, shard in enumerate(self.shards()):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=worker_main, args=(worker_id, child_conn, shard, self.options),
+                                      name=f'proPing worker {worker_id}', daemon=True)
+            process.start()
+            child_conn.close()
+            self.processes.append(process)
+            self.conns.append(parent_conn)
+        self.thread = threading.Thread(target=self.run, name='ShardReceiver', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        conns = list(self.conns)
+        down = []  # Hosts of workers that exited without being told to
+        last_second = None
+        while conns or (down and not self.stopping):
+            for conn in multiprocessing.connection.wait(conns, FOLD_INTERVAL if down else None):
+                try:
+                    report = conn.recv()
+                except (EOFError, OSError):
+                    conns.remove(conn)  # The worker has exited
+                    if not self.stopping:
+                        worker_id = self.conns.index(conn)
+                        shard = self.shards()[worker_id]
+                        log.error('Worker %d (pid %s) exited, its %d host(s) are shown as down from now on',
+                                  worker_id, self.processes[worker_id].pid, len(shard))
+                        down += shard
+                        if last_second is None:
+                            last_second = int(time.time())
+                    continue
+                if isinstance(report, str):
+                    log.error('%s', report)
+                else:
+                    self.on_report(report)
+
+            # Nobody probes the hosts of a dead worker any more, so rather than let their charts go quiet,
+            # each of them gets an error sample for every second since, the way a probe that can't be sent does.
+            # It stands for a second of probing, so it is weighted like that many probes (see ProbeScheduler).
+            now_second = int(time.time())
+            if down and not self.stopping and now_second > last_second:
+                summaries = []
+                for second in range(last_second, now_second):
+                    for host in down:
+                        summary = SecondSummary()
+                        summary.add(STATUS_ERROR, 100.0, None, 0.0, self.options['ping_frequency'])
+                        summaries.append(summary.to_tuple(host, second, None))
+                self.on_report(ShardReport(None, time.time(), summaries, [], [], Instrumentation().snapshot(), None))
+                last_second = now_second
+
+    def stop(self, timeout=1.5):
+        self.stopping = True
+        for conn in self.conns:
+            try:
+                conn.send('stop')
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+        for conn in self.conns:
+            conn.close()
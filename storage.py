@@ -0,0 +1,223 @@
+import os
+import re
+import struct
+import datetime
+
+import numpy as np
+
+# On-disk layout, one directory per host under the data directory:
+#   samples-YYYYMMDD.v2.bin  append-only raw samples for one UTC day, SAMPLE_DTYPE records
+#   samples-YYYYMMDD.bin     the same from before samples were weighted, SAMPLE_DTYPE_V1 records; still read,
+#                            as samples of weight 1
+#   rollup-<N>s.bin          round-robin rollup of N-second buckets, ROLLUP_DTYPE records in a fixed number of
+#                            slots; bucket b lives in slot b % slots, so old buckets are overwritten in place
+# A sample's weight is the probing time it stands for, in probes at the base rate (see ProbeScheduler)
+SAMPLE_DTYPE = np.dtype([('timestamp', '<i8'), ('rtt', '<f4'), ('status', 'u1'), ('weight', '<f4')])  # 17 bytes, packed
+SAMPLE_STRUCT = struct.Struct('<qfBf')  # The same record, for writing one sample at a time
+SAMPLE_DTYPE_V1 = np.dtype([('timestamp', '<i8'), ('rtt', '<f4'), ('status', 'u1')])  # 13 bytes, packed
+RAW_NAME = re.compile(r'samples-(\d{8})(\.v2)?\.bin')
+ROLLUP_DTYPE = np.dtype([('bucket', '<i8'), ('loss_sum', '<f8'), ('count', '<u4'),
+                         ('rtt_sum', '<f8'), ('rtt_count', '<u4')])
+
+# Rollup resolution in seconds -> number of slots kept
+ROLLUPS = {
+    1: 24 * 60 * 60,  # 1 day of 1-second buckets
+    60: 30 * 24 * 60,  # 30 days of 1-minute buckets
+    300: 90 * 24 * 12,  # 90 days of 5-minute buckets
+    3600: 2 * 365 * 24,  # 2 years of 1-hour buckets
+}
+RAW_RETENTION_DAYS = 7
+
+
+def host_directory_name(host):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', host)
+
+
+def raw_sample_paths(directory):
+    # Oldest day first. A day proPing was upgraded on has a file in each format, the old one first.
+    matches = sorted(filter(None, (RAW_NAME.fullmatch(name) for name in os.listdir(directory))),
+                     key=lambda match: (match.group(1), bool(match.group(2))))
+    return [os.path.join(directory, match.group(0)) for match in matches]
+
+
+def read_sample_segments(directory, start=None, end=None):
+    # The raw samples of one host directory with start <= timestamp < end, as read-only memory maps,
+    # one per day file, oldest first. Opens nothing for writing, so it is safe on a live data directory.
+    # Segments of the old format have no weight field; sample_weights fills it in.
+    segments = []
+    for path in raw_sample_paths(directory):
+        dtype = SAMPLE_DTYPE if path.endswith('.v2.bin') else SAMPLE_DTYPE_V1
+        records = os.path.getsize(path) // dtype.itemsize
+        if not records:
+            continue
+        samples = np.memmap(path, dtype=dtype, mode='r', shape=(records,))
+        if start is not None:
+            if samples['timestamp'][-1] < int(start * 1e9):
+                continue
+            samples = samples[np.searchsorted(samples['timestamp'], int(start * 1e9)):]
+        if end is not None:
+            samples = samples[:np.searchsorted(samples['timestamp'], int(end * 1e9))]
+        if len(samples):
+            segments.append(samples)
+    return segments
+
+
+def sample_weights(samples):
+    # The weights of a segment from read_sample_segments
+    if 'weight' in samples.dtype.names:
+        return samples['weight']
+    return np.ones(len(samples), np.float32)
+
+
+def recorded_hosts(data_dir):
+    # The host directories under data_dir that hold raw samples
+    return sorted(name for name in os.listdir(data_dir)
+                  if os.path.isdir(os.path.join(data_dir, name)) and raw_sample_paths(os.path.join(data_dir, name)))
+
+
+class TargetLog:
+    # The persistent history of one host. Raw samples are appended to a buffered file, and each rollup
+    # keeps the bucket in progress in memory and writes it into its memory-mapped slot when the bucket
+    # closes, so the disk sees 13 bytes per sample plus one small record per closed bucket.
+    def __init__(self, directory, retention_days=RAW_RETENTION_DAYS):
+        self.directory = directory
+        self.retention_days = retention_days
+        os.makedirs(directory, exist_ok=True)
+
+        self.rollups = {}
+        # resolution -> [bucket, loss_sum, count, rtt_sum, rtt_count, weight_sum], loss_sum weighted
+        self.open_buckets = {}
+        for resolution, slots in ROLLUPS.items():
+            path = os.path.join(directory, f'rollup-{resolution}s.bin')
+            size = slots * ROLLUP_DTYPE.itemsize
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                with open(path, 'wb') as rollup_file:
+                    rollup_file.truncate(size)
+            self.rollups[resolution] = np.memmap(path, dtype=ROLLUP_DTYPE, mode='r+', shape=(slots,))
+
+        self.raw_file = None
+        self.raw_day = None
+        self.last_flush = 0.0
+
+    def raw_path(self, day):
+        return os.path.join(self.directory, f'samples-{day}.v2.bin')
+
+    def raw_paths(self):
+        return raw_sample_paths(self.directory)
+
+    def _open_raw(self, timestamp):
+        day = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y%m%d')
+        if day == self.raw_day:
+            return
+        if self.raw_file is not None:
+            self.raw_file.close()
+        path = self.raw_path(day)
+        # Drop a torn record left by a crash mid-write, so the file stays a whole number of records
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if size % SAMPLE_DTYPE.itemsize:
+                with open(path, 'r+b') as raw_file:
+                    raw_file.truncate(size - size % SAMPLE_DTYPE.itemsize)
+        self.raw_file = open(path, 'ab')
+        self.raw_day = day
+        self.prune(timestamp)
+
+    def prune(self, timestamp):
+        # Delete raw segments older than the retention period; the rollups age out by themselves
+        oldest = datetime.datetime.fromtimestamp(timestamp - self.retention_days * 86400, datetime.timezone.utc)
+        oldest_day = oldest.strftime('%Y%m%d')
+        for path in self.raw_paths():
+            if RAW_NAME.fullmatch(os.path.basename(path)).group(1) < oldest_day:
+                os.remove(path)
+
+    def append(self, timestamp, status, packet_loss, rtt, weight=1.0):
+        self._open_raw(timestamp)
+        self.raw_file.write(SAMPLE_STRUCT.pack(int(timestamp * 1e9), float('nan') if rtt is None else rtt, status,
+                                              weight))
+
+        for resolution, bucket in self.open_buckets.items():
+            if bucket[0] != int(timestamp // resolution):
+                self._write_bucket(resolution, bucket)
+        for resolution in ROLLUPS:
+            bucket_id = int(timestamp // resolution)
+            bucket = self.open_buckets.get(resolution)
+            if bucket is None or bucket[0] != bucket_id:
+                bucket = self.open_buckets[resolution] = self._resume_bucket(resolution, bucket_id)
+            bucket[1] += packet_loss * weight
+            bucket[2] += 1
+            if rtt is not None:
+                bucket[3] += rtt
+                bucket[4] += 1
+            bucket[5] += weight
+
+        # Once a second, hand the buffered samples and the buckets in progress to the OS, so a crash
+        # loses at most a second of history
+        if timestamp - self.last_flush >= 1:
+            self.raw_file.flush()
+            for resolution, bucket in self.open_buckets.items():
+                self._write_bucket(resolution, bucket)
+            self.last_flush = timestamp
+
+    def _resume_bucket(self, resolution, bucket_id):
+        # Carry on from what is on disk if we were restarted in the middle of this bucket
+        rollup = self.rollups[resolution]
+        record = rollup[bucket_id % len(rollup)]
+        if record['bucket'] == bucket_id and record['count']:
+            return [bucket_id, float(record['loss_sum']), int(record['count']),
+                    float(record['rtt_sum']), int(record['rtt_count']), float(record['count'])]
+        return [bucket_id, 0.0, 0, 0.0, 0, 0.0]
+
+    def _write_bucket(self, resolution, bucket):
+        # On disk loss_sum / count is the bucket's average, so the weighted sum is rescaled to the sample
+        # count; that keeps the format, and readers, unchanged
+        bucket_id, loss_sum, count, rtt_sum, rtt_count, weight_sum = bucket
+        if weight_sum:
+            loss_sum = loss_sum / weight_sum * count
+        rollup = self.rollups[resolution]
+        rollup[bucket_id % len(rollup)] = (bucket_id, loss_sum, count, rtt_sum, rtt_count)
+
+    def read_rollup(self, resolution, end_bucket_id, count):
+        # (bucket ids, loss sums, sample counts, rtt sums, rtt counts) for the count buckets before
+        # end_bucket_id, oldest first, leaving out buckets that were never written or have been overwritten
+        rollup = self.rollups[resolution]
+        bucket_ids = np.arange(end_bucket_id - count, end_bucket_id)
+        records = rollup[bucket_ids % len(rollup)]
+        valid = (records['bucket'] == bucket_ids) & (records['count'] > 0)
+        records = records[valid]
+        return (records['bucket'], records['loss_sum'], records['count'].astype(np.int64),
+                records['rtt_sum'], records['rtt_count'].astype(np.int64))
+
+    def read_samples(self, start=None):
+        # The raw samples as read-only memory maps, one per day file, oldest first
+        if self.raw_file is not None:
+            self.raw_file.flush()
+        return read_sample_segments(self.directory, start)
+
+    def close(self):
+        for resolution, bucket in self.open_buckets.items():
+            self._write_bucket(resolution, bucket)
+        for rollup in self.rollups.values():
+            rollup.flush()
+        if self.raw_file is not None:
+            self.raw_file.close()
+            self.raw_file = None
+            self.raw_day = None
+
+
+class SampleLog:
+    # Persistent history for every monitored host, under one data directory
+    def __init__(self, data_dir, retention_days=RAW_RETENTION_DAYS):
+        self.data_dir = data_dir
+        self.retention_days = retention_days
+        self.target_logs = {}
+
+    def target_log(self, host):
+        target_log = self.target_logs.get(host)
+        if target_log is None:
+            directory = os.path.join(self.data_dir, host_directory_name(host))
+            target_log = self.target_logs[host] = TargetLog(directory, self.retention_days)
+        return target_log
+
+    def close(self):
+        for target_log in self.target_logs.values():
+            target_log.close()
@@ -0,0 +1,278 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from exporter import RESULT_LABELS
+from path import Hop
+from samplestore import sample_status
+
+# A live feed of the results for other programs: every probe result as a 'sample' record and, once it is
+# complete, each second of every host as a 'second' record read from the same 1s buckets as the charts. The
+# records go out as JSON lines to a file or stdout, and/or as server-sent events to anyone connected to
+# http://address:port/events (?type=sample or ?type=second for just one kind).
+#
+# Nothing here ever holds up probing. Ingesting appends each result to a bounded queue; a stream thread
+# turns whatever has queued into records a few times a second, encodes each batch once for every consumer,
+# and hands it to each consumer's own bounded buffer. Every consumer is written to by its own thread, so a
+# slow one only falls behind itself. When a buffer is full its oldest records are dropped, and the consumer
+# gets a 'dropped' record with their number before the next batch.
+FLUSH_INTERVAL = 0.25  # Seconds between batches
+SECOND_DELAY = 2  # Seconds after a second ends before its record goes out, so its last results are in
+QUEUE_SAMPLES = 100000  # Results queued for the stream thread before the oldest are dropped
+CONSUMER_BATCHES = 200  # Batches buffered per consumer before its oldest are dropped
+RECORD_KINDS = ('sample', 'second')
+
+encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def frame_lines(lines):
+    return b''.join(line + b'\n' for line in lines)
+
+
+def frame_events(lines):
+    return b''.join(b'data: ' + line + b'\n\n' for line in lines)
+
+
+def target_fields(target, hop_addresses):
+    if type(target) is Hop:
+        return {'host': target.host, 'hop': target.ttl, 'address': hop_addresses.get(target)}
+    return {'host': target}
+
+
+class StreamConsumer:
+    # One file or connection the stream is written to, with its own buffer of encoded batches. offer is
+    # called on the stream thread and never blocks; run writes the batches out on the consumer's thread.
+    def __init__(self, write, frame=frame_lines, kinds=RECORD_KINDS, max_batches=CONSUMER_BATCHES):
+        self.write = write
+        self.frame = frame
+        self.kinds = kinds
+        self.max_batches = max_batches
+        self.batches = deque()  # (encoded batch, number of records)
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def offer(self, kind, chunk, count):
+        with self.condition:
+            if len(self.batches) >= self.max_batches:
+                self.dropped += self.batches.popleft()[1]
+            self.batches.append((chunk, count))
+            self.condition.notify()
+
+    def close(self):
+        # run writes out what is buffered, then returns
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.batches and not self.closed:
+                    self.condition.wait()
+                if not self.batches:
+                    return
+                chunks = [chunk for chunk, _ in self.batches]
+                self.batches.clear()
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                chunks.insert(0, self.frame([encode({'type': 'dropped', 'records': dropped}).encode()]))
+            try:
+                self.write(b''.join(chunks))
+            except (OSError, ValueError):
+                return  # The reader went away
+
+
+class ResultStream:
+    # Feeds the monitor's results to a file (path, '-' for stdout) and/or event stream clients on port
+    def __init__(self, monitor, path=None, port=None, address='127.0.0.1'):
+        self.monitor = monitor
+        self.results = deque(maxlen=QUEUE_SAMPLES)  # Appended on the ingest thread
+        self.overflow = 0  # Results pushed out of results unread; only the ingest thread writes it
+        self.overflow_reported = 0
+        self.consumers = []
+        self.consumers_lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+        # The file, or stdout, gets a consumer and writer thread of its own
+        self.file = None
+        self.file_consumer = None
+        self.file_thread = None
+        if path is not None:
+            self.file = sys.stdout.buffer if path == '-' else open(path, 'ab')
+            self.file_consumer = StreamConsumer(self._write_file)
+            self.consumers.append(self.file_consumer)
+
+        self.server = None
+        self.server_thread = None
+        if port is not None:
+            stream = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    url = urlsplit(self.path)
+                    if url.path not in ('/events', '/'):
+                        self.send_error(404)
+                        return
+                    kinds = tuple(kind for value in parse_qs(url.query).get('type', [])
+                                  for kind in value.split(',') if kind in RECORD_KINDS) or RECORD_KINDS
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    stream.serve(StreamConsumer(self._write, frame_events, kinds))
+
+                def _write(self, data):
+                    self.wfile.write(data)
+                    self.wfile.flush()
+
+                def log_message(self, format, *args):
+                    pass
+
+            try:
+                self.server = ThreadingHTTPServer((address, port), Handler)
+            except OSError as e:
+                if self.file is not None and self.file is not sys.stdout.buffer:
+                    self.file.close()
+                raise OSError(f'Could not serve the result stream on {address}:{port}: {e}') from e
+            self.server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def put(self, result_tuple):
+        # Called on the ingest thread for every result
+        if len(self.results) == QUEUE_SAMPLES:
+            self.overflow += 1
+        self.results.append(result_tuple)
+
+    def extend(self, result_tuples):
+        overflow = len(self.results) + len(result_tuples) - QUEUE_SAMPLES
+        if overflow > 0:
+            self.overflow += overflow
+        self.results.extend(result_tuples)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='ResultStream', daemon=True)
+        self.thread.start()
+        if self.file_consumer is not None:
+            self.file_thread = threading.Thread(target=self.file_consumer.run, name='ResultStreamFile', daemon=True)
+            self.file_thread.start()
+        if self.server is not None:
+            self.server_thread = threading.Thread(target=self.server.serve_forever, name='ResultStreamServer',
+                                                  daemon=True)
+            self.server_thread.start()
+
+    def stop(self, timeout=1.5):
+        # Send what is still queued, then let every consumer finish writing
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+            self.thread = None
+        with self.consumers_lock:
+            for consumer in self.consumers:
+                consumer.close()
+        if self.file_thread is not None:
+            self.file_thread.join(timeout=timeout)
+            self.file_thread = None
+        if self.file is not None:
+            if self.file is sys.stdout.buffer:
+                self.file.flush()
+            else:
+                self.file.close()
+            self.file = None
+        if self.server is not None:
+            if self.server_thread is not None:
+                self.server.shutdown()
+                self.server_thread.join()
+                self.server_thread = None
+            self.server.server_close()
+
+    def serve(self, consumer):
+        # Runs on the connection's thread until the client goes away or the stream stops
+        with self.consumers_lock:
+            if not self.running:
+                return
+            self.consumers.append(consumer)
+        try:
+            consumer.run()
+        finally:
+            with self.consumers_lock:
+                self.consumers.remove(consumer)
+
+    def run(self):
+        next_second = int(time.time()) - SECOND_DELAY
+        while True:
+            stopping = not self.running
+            self.publish('sample', self.sample_records())
+            now_second = int(time.time()) - (0 if stopping else SECOND_DELAY)  # On the way out, every ended second
+            if now_second > next_second:
+                self.publish('second', self.second_records(next_second, now_second))
+                next_second = now_second
+            if stopping:
+                return
+            time.sleep(FLUSH_INTERVAL)
+
+    def sample_records(self):
+        hop_addresses = self.monitor.hop_addresses
+        records = []
+        overflow = self.overflow
+        if overflow != self.overflow_reported:
+            records.append(encode({'type': 'dropped', 'records': overflow - self.overflow_reported}).encode())
+            self.overflow_reported = overflow
+        results = self.results
+        for _ in range(len(results)):
+            result_tuple = results.popleft()
+            if type(result_tuple) is not tuple:
+                continue  # A worker's ShardReport; its seconds still come through as 'second' records
+            target, timestamp, result, rtt, weight = result_tuple
+            record = {'type': 'sample', **target_fields(target, hop_addresses), 'time': round(timestamp, 6),
+                      'result': RESULT_LABELS[sample_status(result)],
+                      'rtt': round(rtt, 6) if rtt is not None else None}
+            if weight != 1.0:
+                record['weight'] = weight
+            records.append(encode(record).encode())
+        return records
+
+    def second_records(self, first_second, end_second):
+        # The seconds in [first_second, end_second) of every host that had samples in them
+        monitor = self.monitor
+        summaries = []
+        with monitor.lock:
+            for target, state in monitor.states.items():
+                for second in range(max(first_second, end_second - state.buckets_1s.num_buckets + 1), end_second):
+                    summary = state.buckets_1s.bucket_summary(second)
+                    if summary is not None:
+                        summaries.append((target, second, summary))
+        records = []
+        for target, second, (count, loss, (p50, p95, p99), jitter) in summaries:
+            records.append(encode({'type': 'second', **target_fields(target, monitor.hop_addresses), 'time': second,
+                                   'probes': count, 'loss': round(loss, 3), 'rtt_p50': p50, 'rtt_p95': p95,
+                                   'rtt_p99': p99, 'jitter': round(jitter, 6) if jitter is not None else None
+                                   }).encode())
+        return records
+
+    def publish(self, kind, lines):
+        # Encode the batch once per framing, and hand it to every consumer that wants this kind of record
+        if not lines:
+            return
+        framed = {}
+        with self.consumers_lock:
+            for consumer in self.consumers:
+                if kind not in consumer.kinds:
+                    continue
+                chunk = framed.get(consumer.frame)
+                if chunk is None:
+                    chunk = framed[consumer.frame] = consumer.frame(lines)
+                consumer.offer(kind, chunk, len(lines))
+
+    def _write_file(self, data):
+        self.file.write(data)
+        self.file.flush()
@@ -0,0 +1,82 @@
+import math
+import random
+
+# A deterministic stand-in for the network, for benchmarks and load tests: results are produced on a
+# simulated clock, so hours of probing at any rate can be generated in seconds and replayed exactly.
+
+LOSS_PATTERNS = ('none', 'random', 'bursty', 'outage')
+
+
+class SimulatedClock:
+    def __init__(self, start=1700000000.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+        return self.now
+
+
+class SyntheticNetwork:
+    # Decides what happens to each probe of one target.
+    #   loss_pattern 'random': each probe is lost with probability loss
+    #   loss_pattern 'bursty': a two-state (Gilbert-Elliott) model; in the bad state every probe is lost, the
+    #                          state changes are tuned so the long-run loss is `loss` in bursts of ~burst_length
+    #   loss_pattern 'outage': nothing comes back for outage_seconds every outage_every seconds
+    # Round-trip times are log-normal around rtt_median, with a spike_rate chance of a 10x slower reply.
+    def __init__(self, seed=1, loss_pattern='random', loss=0.02, rtt_median=0.02, rtt_sigma=0.3, spike_rate=0.0,
+                 burst_length=10, outage_every=600, outage_seconds=30):
+        if loss_pattern not in LOSS_PATTERNS:
+            raise ValueError(f'Unknown loss pattern {loss_pattern!r}, expected one of {", ".join(LOSS_PATTERNS)}')
+        self.rng = random.Random(seed)
+        self.loss_pattern = loss_pattern
+        self.loss = loss
+        self.rtt_mu = math.log(rtt_median)
+        self.rtt_sigma = rtt_sigma
+        self.spike_rate = spike_rate
+        self.bad = False
+        self.leave_bad = 1 / burst_length
+        self.enter_bad = self.leave_bad * loss / (1 - loss) if loss < 1 else 1.0
+        self.outage_every = outage_every
+        self.outage_seconds = outage_seconds
+
+    def lost(self, timestamp):
+        if self.loss_pattern == 'random':
+            return self.rng.random() < self.loss
+        if self.loss_pattern == 'bursty':
+            self.bad = self.rng.random() >= self.leave_bad if self.bad else self.rng.random() < self.enter_bad
+            return self.bad
+        if self.loss_pattern == 'outage':
+            return timestamp % self.outage_every < self.outage_seconds
+        return False
+
+    def probe(self, timestamp):
+        # (result, rtt) the way the scheduler reports them
+        if self.lost(timestamp):
+            return '100', None
+        rtt = self.rng.lognormvariate(self.rtt_mu, self.rtt_sigma)
+        if self.spike_rate and self.rng.random() < self.spike_rate:
+            rtt *= 10
+        return '0', rtt
+
+
+def synthetic_results(targets, rate, seconds, clock, networks, batch_seconds=1.0):
+    # Yield batches of (target, timestamp, result, rtt, weight) tuples covering `seconds` of probing every
+    # target `rate` times a second, with the sends spread evenly like ProbeScheduler spreads them. The clock
+    # is advanced to the end of each batch before it is yielded.
+    interval = 1 / rate / len(targets)
+    sends = 0
+    start = clock.time()
+    total_sends = int(seconds * rate * len(targets))
+    while sends < total_sends:
+        batch_end = min(total_sends, sends + max(1, int(batch_seconds / interval)))
+        batch = []
+        for send in range(sends, batch_end):
+            target = targets[send % len(targets)]
+            timestamp = start + send * interval
+            batch.append((target, timestamp, *networks[target].probe(timestamp), 1.0))
+        sends = batch_end
+        clock.now = start + sends * interval
+        yield batch